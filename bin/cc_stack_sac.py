@@ -2,21 +2,36 @@
 """
 Executable files for cross-correlation and stacking operations
 """
-from sacpy.processing import iirfilter_f32, iirfilter2_f32, taper, tnorm_f32, fwhiten_f32
+from sacpy.processing import iirdesign_f32, sosfilter2_f32, sosfreqz_f32, taper2, detrend2, tnorm2_f32, fwhiten2_f32
 from sacpy.sac import c_rd_sac, c_wrt_sac, c_mk_sachdr_time
 import time
 import sacpy.geomath as geomath
 import h5py
 import pyfftw
 import numpy as np
+from scipy.fft import next_fast_len
 import sys
+import os
 import getopt
+import atexit
+import threading
 from numpy.random import rand
 from glob import glob
-from numba import jit
+from fnmatch import fnmatch
+from numba import jit, prange, get_num_threads, set_num_threads, get_thread_id, cuda, config as numba_config
 
 from mpi4py import MPI
 
+pyfftw.interfaces.cache.enable()
+fftw_plan_cache = dict() # {(fftsize, direction): (input_buf, output_buf, plan)} reused across calls
+fftw_block_rows = 32     # number of rows transformed by a single FFTW plan call, so that the buffers are bounded
+fftw_threads = 1         # FFTW (and numba) threads for each rank, set in main from the cores available to the rank
+mpi_log_buf = dict()     # {file: [line, ...]} log lines buffered until the next flush
+mpi_log_level = 2        # log lines with an indent level (n_pre) bigger than this are dropped
+h5_ccstack_filters = dict(compression='gzip', compression_opts=1, shuffle=True) # portable filters for the hdf5 `ccstack` dataset
+cc_tile_size = 2048      # number of frequency bins in a tile for ccstack, so that a tile of all spectra stays in L2 cache
+trace_errors = (ValueError, FloatingPointError, ZeroDivisionError) # errors from bad traces. Others (e.g., numba typing errors) are not caught
+
 def main(mode, 
             fnm_wildcard, tmark, t1, t2, delta, input_format='sac', pre_detrend=True, pre_taper_ratio= 0.005, pre_filter= None,
             tnorm = (128.0, 0.02, 0.066666), swht= 0.02,
@@ -24,7 +39,7 @@ def main(mode,
             daz_range= None, gcd_range= None, gc_center_rect= None, gc_center_circle=None, min_recordings=0, epdd=False,
             post_fold = False, post_taper_ratio = 0.005, post_filter=None, post_norm = False, post_cut= None,
             output_pre_fnm= 'junk', output_format= ['hdf5'],
-            log_prefnm= 'cc_mpi_log', log_mode=None, spec_acc_threshold = 0.001, random_sample=-1.0 ):
+            log_prefnm= 'cc_mpi_log', log_mode=None, spec_acc_threshold = 0.001, random_sample=-1.0, use_gpu=False, log_level=2, spec_int16=False ):
     """
     The main function.
 
@@ -72,13 +87,24 @@ def main(mode,
         post_cut:         A tuple to cut the correlation stacks before outputting. Set None to disable.
     - 5. output:
         log_prefnm     : mpi log filename prefix;
+        log_level      : verbose level of logging. Only the lines with indent levels no bigger than this are logged.
+                         (0: section titles, 1: parameters and summaries, 2: each job.)
         output_pre_fnm : output filename prefix;
         output_format  : a list of output format. (e.g., output_format=['sac'], output_format=['sac', 'h5'] )
+    - Others:
+        use_gpu: True to run the cross-correlation and stacking on CUDA devices.
+                 Fall back to CPU if no CUDA device is available.
+        spec_int16: True to quantize the spectra into complex-int16 for the cross-correlation and stacking on CPU,
+                    which halves the memory traffic. The stacks and the later post-processing are still in float32.
     """
     mpi_comm = MPI.COMM_WORLD.Dup()
     mpi_rank = mpi_comm.Get_rank()
     mpi_ncpu = mpi_comm.Get_size()
 
+    global mpi_log_level, fftw_threads
+    mpi_log_level = log_level
+    fftw_threads = cores_per_rank(mpi_comm)
+    set_num_threads( min(fftw_threads, numba_config.NUMBA_NUM_THREADS) ) # numba threads and thread-private stacks are bounded for each rank as well
     mpi_log_fid = None # Set None to enable MPI logging on each PROC
     if log_mode == None or mpi_rank in log_mode:
         mpi_log_fid = open('%s_%03d.txt' % (log_prefnm, mpi_rank), 'w' )
@@ -100,9 +126,11 @@ def main(mode,
     # dependent parameters
     sampling_rate = 1.0/delta
     npts          = int( np.round((t2-t1)/delta) ) + 1
-    fftsize       = npts * 2
+    fftsize       = next_fast_len(npts, True) * 2 # even 5-smooth size no less than 2*npts, so that it stays 2*npts for 5-smooth npts
     df            = 1.0/(delta*npts) if npts % 2 == 0 else 1.0/(delta*(npts+1)) # df of raw traces
     cc_df            = 1.0/(delta*fftsize) # df of cross-correlation
+    # filters are designed once here and applied to all time series
+    pre_filter_sos = iirdesign_f32(delta, 0, pre_filter[0], pre_filter[1], pre_filter[2], 2) if pre_filter != None else None
     if True: # user-defined parameters
         mpi_print_log(mpi_log_fid, 0, False, 'Set reading and pre-processing parameters')
         mpi_print_log(mpi_log_fid, 1, False, 'fnm_wildcard:   ', fnm_wildcard)
@@ -124,7 +152,7 @@ def main(mode,
     ############################################################################################################################################
     wtlen_sec, wflen_hz = None, None
     wt_size, wt_f1, wt_f2, wf_size = None, None, None, None
-    if tnorm != None:
+    if tnorm is not None:
         junk, wt_f1, wt_f2 = tnorm
         wtlen_sec = junk
         wt_size = (int(np.round(junk / delta) ) //2 ) * 2 + 1
@@ -140,13 +168,13 @@ def main(mode,
     ############################################################################################################################################
     ### 2.1 Optional acceleration for spectral whitening and spectral cross-correlation
     ############################################################################################################################################
-    acc_range_raw = None, None # for npts
-    acc_range_cc  = None, None  # for fftsize
+    tmp_npts = npts if npts % 2 ==0 else npts+1
+    acc_range_raw = 0, tmp_npts//2+1 # for npts
+    acc_range_cc  = 0, fftsize//2+1  # for fftsize
     if post_filter != None:
         junk1, junk2 = post_filter[1], post_filter[2]
         if swht != None:
             junk2 = junk2 + swht
-        tmp_npts = npts if npts % 2 ==0 else npts+1
         acc_range_raw = acc_bound(tmp_npts, sampling_rate, junk1, junk2, spec_acc_threshold)
         acc_range_cc = acc_bound(fftsize, sampling_rate, junk1, junk2, spec_acc_threshold)
 
@@ -159,11 +187,11 @@ def main(mode,
     ############################################################################################################################################
     #### 3. Init selection criteria
     ############################################################################################################################################
-    if daz_range != None or gcd_range != None or gc_center_rect != None or gc_center_circle != None:
-        daz_range      = (-0.1, 90.1) if daz_range == None else daz_range
-        gcd_range      = (-0.1, 90.1) if gcd_range == None else gcd_range
-        gc_center_rect = [(-9999, 9999, -9999, 9999)] if gc_center_rect == None else gc_center_rect
-        gc_center_circle = [(0, 0, 9999)] if gc_center_circle == None else gc_center_circle
+    if daz_range is not None or gcd_range is not None or gc_center_rect is not None or gc_center_circle is not None:
+        daz_range      = (-0.1, 90.1) if daz_range is None else daz_range
+        gcd_range      = (-0.1, 90.1) if gcd_range is None else gcd_range
+        gc_center_rect = [(-9999, 9999, -9999, 9999)] if gc_center_rect is None else gc_center_rect
+        gc_center_circle = [(0, 0, 9999)] if gc_center_circle is None else gc_center_circle
     # logging
     if True:
         mpi_print_log(mpi_log_fid, 0, False, 'Set selection criteria')
@@ -174,9 +202,15 @@ def main(mode,
         mpi_print_log(mpi_log_fid, 1, False, 'minmal number of recordings: ', min_recordings )
     if random_sample > 0:
         mpi_print_log(mpi_log_fid, 1, False, 'Random resampling: ',  random_sample )
+    if use_gpu and not cuda.is_available():
+        mpi_print_log(mpi_log_fid, 1, False, 'No CUDA device available, and hence we use CPU for ccstack.' )
+        use_gpu = False
+    if spec_int16 and not use_gpu:
+        mpi_print_log(mpi_log_fid, 1, False, 'Quantize the spectra into complex-int16 for ccstack.' )
     ############################################################################################################################################
     ### 4. Init post-processing parameters
     ############################################################################################################################################
+    post_filter_sos = iirdesign_f32(delta, 0, post_filter[0], post_filter[1], post_filter[2], 2) if post_filter != None else None
     # logging
     if True:
         mpi_print_log(mpi_log_fid, 0, False, 'Set post-processing parameters' )
@@ -192,8 +226,12 @@ def main(mode,
     spec_stack_mat = np.zeros( (dist.size, nrfft_valid), dtype= np.complex64 )
     stack_count    = np.zeros( dist.size, dtype=np.int32 )
 
+    # parallel hdf5 output: each rank post-processes and outputs a part of the distance bins
+    flag_parallel_io = h5py.get_config().mpi and dist.size >= mpi_ncpu
     global_spec_stack_mat, global_stack_count= None, None
-    if mpi_rank == 0:
+    if flag_parallel_io:
+        global_stack_count    = np.zeros( dist.size, dtype=np.int32 )
+    elif mpi_rank == 0:
         global_spec_stack_mat = np.zeros( (dist.size, nrfft_valid), dtype= np.complex64 )
         global_stack_count    = np.zeros( dist.size, dtype=np.int32 )
     # logging
@@ -207,31 +245,33 @@ def main(mode,
     ############################################################################################################################################
     ### 6. Distribut MPI
     ############################################################################################################################################
-    global_wildcards, local_wildcards, flag_input_format = list(), list(), 0
+    # jobs are dispatched dynamically. The jobs with more sac files go first to reduce the idle time in the end.
+    # the file system is scanned only once on RANK0, and the file lists are broadcasted.
+    global_jobs, flag_input_format = list(), 0
     if input_format in ('sac', 'SAC'):
-        global_wildcards  = sorted( glob('/'.join(fnm_wildcard.split('/')[:-1] ) ) )
-        remainders = fnm_wildcard.split('/')[-1]
-        local_wildcards = ['%s/%s' % (it, remainders) for it in  global_wildcards[mpi_rank::mpi_ncpu]]
+        if mpi_rank == 0:
+            global_jobs = scan_sac_files(fnm_wildcard)
+            global_jobs = sorted(global_jobs, key=lambda it: len(it[1]), reverse=True )
+        global_jobs = mpi_comm.bcast(global_jobs, root=0)
         flag_input_format = 0
     # logging
     if True:
-        mpi_print_log(mpi_log_fid, 0, False, 'Distribute MPI jobs')
-        mpi_print_log(mpi_log_fid, 1, False, 'Total job size:    ', len(global_wildcards) )
-        mpi_print_log(mpi_log_fid, 1, True,  'Jobs on this node: ', len(local_wildcards) )
+        mpi_print_log(mpi_log_fid, 0, False, 'Distribute MPI jobs (dynamically)')
+        mpi_print_log(mpi_log_fid, 1, True,  'Total job size:    ', len(global_jobs) )
     ############################################################################################################################################
     ### 7. start running
     ############################################################################################################################################
     if True:
         mpi_print_log(mpi_log_fid, 0, False, 'Start running...')
     tc_rdw, tc_cc = 0.0, 0.0
-    for idx_job, it in enumerate(local_wildcards):
-        mpi_print_log(mpi_log_fid, 1, True, '-',idx_job+1, it)
+    for idx_job, (it, fnms) in enumerate(mpi_dynamic_jobs(mpi_comm, global_jobs) ):
+        mpi_print_log(mpi_log_fid, 1, False, '-',idx_job+1, it)
         ### (1). read and pre-processing and whitening
         tc_junk = time.time()
         whitened_spectra_mat, stlo, stla, evlo, evla, az, baz, gcarc= None, None, None, None, None, None, None, None
         if flag_input_format == 0: # input sac
-            tmp = rd_wh_sac(it, delta, tmark, t1, t2, npts,
-                            pre_detrend, pre_taper_ratio, pre_filter,
+            tmp = rd_wh_sac(fnms, delta, tmark, t1, t2, npts,
+                            pre_detrend, pre_taper_ratio, pre_filter_sos,
                             wtlen_sec, wt_f1, wt_f2, wflen_hz, 0, acc_range_raw[1], pre_taper_ratio,
                             fftsize, nrfft_valid, mpi_log_fid)
             whitened_spectra_mat, stlo, stla, evlo, evla, az, baz, gcarc = tmp
@@ -253,7 +293,8 @@ def main(mode,
 
         ### (4) cc and stack
         tc_junk = time.time()
-        if daz_range != None or gcd_range != None or gc_center_rect != None or gc_center_circle != None:
+        flag_selection = daz_range is not None or gcd_range is not None or gc_center_rect is not None or gc_center_circle is not None
+        if flag_selection:
             center_clo1 = np.array( [rect[0] for rect in gc_center_rect] )
             center_clo2 = np.array( [rect[1] for rect in gc_center_rect] )
             center_cla1 = np.array( [rect[2] for rect in gc_center_rect] )
@@ -262,7 +303,20 @@ def main(mode,
             circle_center_clo = np.array( [it[0] for it in gc_center_circle] )
             circle_center_cla = np.array( [it[1] for it in gc_center_circle] )
             circle_center_radius = np.array( [it[2] for it in gc_center_circle] )
-
+        if use_gpu or spec_int16:
+            nrow = spec_stack_mat.shape[0]
+            idx_mat = dist_index(pairwise_dist(lon, lat, gcarc, epdd), nrow, dist_range[0], dist_range[1], dist_step)
+            if flag_selection:
+                select_pairs(idx_mat, lon, lat, azimuth, pt_lon, pt_lat, daz_range[0], daz_range[1], gcd_range[0], gcd_range[1],
+                                center_clo1, center_clo2, center_cla1, center_cla2,
+                                circle_center_clo, circle_center_cla, circle_center_radius)
+            pairs = index_to_pairs(idx_mat, random_sample)
+            if use_gpu:
+                local_ncc = cu_spec_ccstack(whitened_spectra_mat, pairs, spec_stack_mat, stack_count, acc_range_cc[0], acc_range_cc[1])
+            else:
+                qspec, scale = quantize_spec(whitened_spectra_mat, acc_range_cc[0], acc_range_cc[1])
+                local_ncc = pairs_ccstack_i16(qspec, scale, pairs, spec_stack_mat, stack_count, acc_range_cc[0], acc_range_cc[1])
+        elif flag_selection:
             local_ncc = spec_ccstack2(whitened_spectra_mat, lon, lat, gcarc, epdd,
                                         spec_stack_mat, stack_count,
                                         dist_range[0], dist_range[1], dist_step, acc_range_cc[0], acc_range_cc[1],
@@ -280,7 +334,7 @@ def main(mode,
         tc_cc  = tc_cc  + local_tc_cc
         if True:
             local_tc = local_tc_rdw+ local_tc_cc + 0.001
-            mpi_print_log(mpi_log_fid, 2, False,
+            mpi_print_log(mpi_log_fid, 2, True,
                             '+ rd&whiten: %.1fs(%d%%)(%d), ccstack %.1fs(%d%%) (%d)' % (
                             local_tc_rdw, local_tc_rdw/local_tc*100, nsac, local_tc_cc, local_tc_cc/local_tc*100, local_ncc ) )
     if True:
@@ -290,24 +344,60 @@ def main(mode,
     ############################################################################################################################################
     ### 8. MPI collecting
     ############################################################################################################################################
-    if True:
-        mpi_print_log(mpi_log_fid, 0, True, 'MPI collecting(reducing) to RANK0...')
-    mpi_comm.Reduce([spec_stack_mat, MPI.C_FLOAT_COMPLEX], [global_spec_stack_mat, MPI.C_FLOAT_COMPLEX], MPI.SUM, root= 0)
-    mpi_comm.Reduce([stack_count, MPI.INT32_T], [global_stack_count, MPI.INT32_T], MPI.SUM, root= 0 )
-    mpi_comm.Barrier()
+    if flag_parallel_io:
+        ### each rank receives the sum of its own part of distance bins
+        row_bounds = (np.arange(mpi_ncpu+1) * dist.size) // mpi_ncpu
+        row1, row2 = row_bounds[mpi_rank], row_bounds[mpi_rank+1]
+        if True:
+            mpi_print_log(mpi_log_fid, 0, True, 'MPI collecting(reducing and scattering) rows %d-%d to this rank...' % (row1, row2) )
+        local_spec_stack_mat = np.zeros( (row2-row1, nrfft_valid), dtype= np.complex64 )
+        recvcounts = [int(it)*nrfft_valid for it in np.diff(row_bounds)]
+        mpi_comm.Reduce_scatter([spec_stack_mat, MPI.C_FLOAT_COMPLEX], [local_spec_stack_mat, MPI.C_FLOAT_COMPLEX], recvcounts, MPI.SUM)
+        mpi_comm.Allreduce([stack_count, MPI.INT32_T], [global_stack_count, MPI.INT32_T], MPI.SUM)
+        del spec_stack_mat
+        mpi_comm.Barrier()
+    else:
+        ### non-blocking reduction in chunks of rows, so that RANK0 can post-process a chunk while the next is still reducing
+        nchunk = min(dist.size, 8)
+        row_bounds = (np.arange(nchunk+1) * dist.size) // nchunk
+        if True:
+            mpi_print_log(mpi_log_fid, 0, True, 'MPI collecting(reducing) to RANK0 in %d chunks...' % nchunk)
+        mpi_comm.Reduce([stack_count, MPI.INT32_T], [global_stack_count, MPI.INT32_T], MPI.SUM, root= 0 )
+        reqs = list()
+        for row1, row2 in zip(row_bounds[:-1], row_bounds[1:]):
+            recvbuf = global_spec_stack_mat[row1:row2] if mpi_rank == 0 else None
+            reqs.append( mpi_comm.Ireduce([spec_stack_mat[row1:row2], MPI.C_FLOAT_COMPLEX], [recvbuf, MPI.C_FLOAT_COMPLEX], MPI.SUM, root= 0) )
+        if mpi_rank != 0:
+            MPI.Request.Waitall(reqs)
+        # no barrier here, otherwise all the chunks are reduced before RANK0 starts post-processing the first one.
 
     ############################################################################################################################################
-    ### On RANK0
+    ### On all RANKs for their own distance bins if parallel hdf5 is available, otherwise on RANK0
     ### 9 ifft and
     ### 10. post processing
     ### 11. output
     ############################################################################################################################################
-    if mpi_rank == 0:
+    if flag_parallel_io:
+        absolute_amp = np.ones(row2-row1, dtype=np.float32)
+        cc_t1, cc_t2, cc_mat = post_proc(local_spec_stack_mat, absolute_amp, fftsize, npts, delta,
+                                    post_fold, post_taper_ratio, post_filter_sos, post_norm, post_cut, mpi_log_fid)
+
+        output_mpi(cc_mat, (row1, row2), global_stack_count, dist, absolute_amp, cc_t1, cc_t2, delta, output_pre_fnm, output_format,
+                    mpi_comm, mpi_log_fid)
+    elif mpi_rank == 0:
         absolute_amp = np.ones(dist.size, dtype=np.float32)
-        cc_t1, cc_t2, cc_mat = post_proc(global_spec_stack_mat, absolute_amp, fftsize, npts, delta,
-                                    post_fold, post_taper_ratio, post_filter, post_norm, post_cut, mpi_log_fid)
-        
+        cc_mat = list()
+        for ichunk, (row1, row2) in enumerate(zip(row_bounds[:-1], row_bounds[1:]) ):
+            reqs[ichunk].Wait()
+            cc_t1, cc_t2, junk = post_proc(global_spec_stack_mat[row1:row2], absolute_amp[row1:row2], fftsize, npts, delta,
+                                    post_fold, post_taper_ratio, post_filter_sos, post_norm, post_cut,
+                                    mpi_log_fid if ichunk == 0 else None)
+            cc_mat.append(junk)
+        cc_mat = np.concatenate(cc_mat, axis=0)
+
         output(cc_mat, global_stack_count, dist, absolute_amp, cc_t1, cc_t2, delta, output_pre_fnm, output_format, mpi_log_fid)
+    if not flag_parallel_io:
+        mpi_comm.Barrier()
     ########################################################################################################################################
     ##### Done
     ########################################################################################################################################
@@ -316,41 +406,144 @@ def main(mode,
     if mpi_log_fid != None:
         mpi_log_fid.close()
 
+def mpi_dynamic_jobs(mpi_comm, jobs, tag_req=7001, tag_job=7002):
+    """
+    Yield the elements of `jobs`, a list that is the same on all ranks, with dynamic load balancing.
+    RANK0 hands out the index of the next unprocessed job to the other ranks with point-to-point messages,
+    and it also runs jobs itself.
+    - If the MPI library provides `MPI.THREAD_MULTIPLE`, a thread of RANK0 answers the requests all the time,
+      so that the other ranks never wait for the jobs of RANK0.
+    - Otherwise, RANK0 answers the first request of every other rank before taking any job itself,
+      and then answers the requests whenever it is between two of its own jobs (it polls with `Iprobe`).
+    The other ranks ask for a job only after finishing the previous one, so that no job is reserved
+    behind a long running one.
+
+    This is a collective generator, and hence all ranks should iterate it to the end.
+    """
+    mpi_rank, mpi_ncpu = mpi_comm.Get_rank(), mpi_comm.Get_size()
+    njob = len(jobs)
+    req_buf, job_buf = np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64)
+    if mpi_rank == 0:
+        nworker = mpi_ncpu-1
+        inext = [0] # index of the next unprocessed job, shared with the dispatching thread
+        lock = threading.Lock()
+        def take_job():
+            with lock:
+                ijob = inext[0]
+                inext[0] = min(ijob+1, njob)
+            return ijob
+        status = MPI.Status()
+        def answer():
+            # answer a single request, and return 1 if the requesting rank is told there are no jobs left
+            mpi_comm.Recv([req_buf, MPI.INT64_T], source=MPI.ANY_SOURCE, tag=tag_req, status=status)
+            job_buf[0] = take_job()
+            mpi_comm.Send([job_buf, MPI.INT64_T], dest=status.Get_source(), tag=tag_job)
+            return 1 if job_buf[0] >= njob else 0
+        dispatcher = None
+        if nworker > 0 and MPI.Query_thread() == MPI.THREAD_MULTIPLE:
+            def dispatch():
+                nfinished = 0 # number of ranks that have been told there are no jobs left
+                while nfinished < nworker:
+                    if mpi_comm.Iprobe(source=MPI.ANY_SOURCE, tag=tag_req):
+                        nfinished += answer()
+                    else:
+                        time.sleep(0.001) # do not take a core from the jobs of RANK0
+            dispatcher = threading.Thread(target=dispatch, daemon=True)
+            dispatcher.start()
+        else:
+            nfinished = 0 # number of ranks that have been told there are no jobs left
+            for irank in range(nworker): # the first job of each rank, before RANK0 takes any
+                if nfinished >= nworker:
+                    break
+                nfinished += answer()
+        while True:
+            if dispatcher is None:
+                while nfinished < nworker and mpi_comm.Iprobe(source=MPI.ANY_SOURCE, tag=tag_req):
+                    nfinished += answer()
+            ijob = take_job()
+            if ijob >= njob:
+                break
+            yield jobs[ijob]
+        # no jobs left, wait for the ranks that are still running
+        if dispatcher is None:
+            while nfinished < nworker:
+                nfinished += answer()
+        else:
+            dispatcher.join()
+    else:
+        while True:
+            mpi_comm.Send([req_buf, MPI.INT64_T], dest=0, tag=tag_req)
+            mpi_comm.Recv([job_buf, MPI.INT64_T], source=0, tag=tag_job)
+            if job_buf[0] >= njob:
+                break
+            yield jobs[job_buf[0]]
+def scan_sac_files(fnm_wildcard):
+    """
+    Scan the file system for `fnm_wildcard` (e.g., `in*/*.sac`), with a single `glob` for the directories and
+    a single `os.scandir` for each directory.
+
+    Return: a list of (wildcard, fnms) for each directory, where `fnms` is the sorted list of the matching filenames.
+    """
+    remainders = fnm_wildcard.split('/')[-1]
+    flag_hidden = remainders.startswith('.') # the same as glob, do not match hidden files unless required
+    jobs = list()
+    for dirnm in sorted( glob('/'.join(fnm_wildcard.split('/')[:-1] ) ) ):
+        if not os.path.isdir(dirnm):
+            continue
+        with os.scandir(dirnm) as entries:
+            fnms = sorted( ['%s/%s' % (dirnm, it.name) for it in entries
+                                if fnmatch(it.name, remainders) and (flag_hidden or not it.name.startswith('.') ) ] )
+        jobs.append( ('%s/%s' % (dirnm, remainders), fnms) )
+    return jobs
 def mpi_print_log(file, n_pre, flush, *objects, end='\n'):
     """
     Set file=None to disable logging.
+    The lines are buffered in memory, and are written to the file at once when `flush` is True,
+    so that many ranks do not hit the shared file system for every line.
+    Lines with `n_pre` bigger than `mpi_log_level` are dropped.
     """
-    if file != None:
+    if file == None:
+        return
+    if n_pre <= mpi_log_level:
         tmp = '>>> ' if n_pre<=0 else '    '*n_pre
-        print(tmp, file=file, end='' )
-        print(*objects, file=file, flush=flush, end=end )
-def rd_wh_sac(fnm_wildcard, delta, tmark, t1, t2, npts,
-              pre_detrend, pre_taper_ratio , pre_filter, # preproc args
+        mpi_log_buf.setdefault(file, list()).append( tmp + ' '.join([str(it) for it in objects]) + end )
+    if flush and file in mpi_log_buf:
+        file.write( ''.join(mpi_log_buf.pop(file) ) )
+        file.flush()
+def mpi_flush_log():
+    """
+    Write out all the buffered log lines of `mpi_print_log(...)`, e.g., before exiting with an error.
+    """
+    for file in list(mpi_log_buf):
+        lines = mpi_log_buf.pop(file)
+        if not file.closed:
+            file.write( ''.join(lines) )
+            file.flush()
+atexit.register(mpi_flush_log)
+def rd_wh_sac(fnms, delta, tmark, t1, t2, npts,
+              pre_detrend, pre_taper_ratio , pre_filter_sos, # preproc args
               wtlen_sec, w_f1, w_f2, wflen_hz, speedup_i1, speedup_i2, whiten_taper_ratio, # whitening args
               fftsize, nrfft_valid, mpi_log_fid):
     """
-    Read, preproc, and whiten many sacfiles given a filename template `sacfnm_template`.
+    Read, preproc, and whiten many sacfiles given a list of filenames `fnms`.
     Those sac files can be recorded at many receivers for the same event, or they
     can be recorded at the same receiver from different events.
 
-    fnm_wildcard:    The filename template that contain wildcards. The function with use
-                     `glob(sacfnm_template)` to obtain all sac filenames.
+    fnms:            A list of sac filenames. (e.g., from `scan_sac_files(...)`)
     tmark, t1, t2:   The cut time window to read sac time series.
 
     pre_detrend:     Set True to enable detrend after reading.
     pre_taper_ratio: Set taper ratio (0~-0.5) to apply taper after the optional detrend.
-    pre_filter:      Filter all the time series. Set `None` to disable filter.
-                     The filter can be ('bandpass', f1, f2), ('lowpass', fc, meaningless_f) or
-                     ('highpass', fc, meaningless_f).
+    pre_filter_sos:  Filter all the time series with the filter designed by `iirdesign_f32(...)`.
+                     Set `None` to disable filter.
 
     Return: (spectra, stlo, stla, evlo, evla, az, baz)
     """
     ###
-    fnms = sorted( glob(fnm_wildcard) )
+    fnms = list(fnms) # a copy, as the filenames of valid rows are kept in it below
     nsac = len(fnms)
     ###
     sampling_rate = 1.0/delta
-    btype, f1, f2 = pre_filter if pre_filter != None else (None, None, None)
     whiten_taper_length = int(npts * whiten_taper_ratio)
     ### buffer to return
     spectra = np.zeros((nsac, nrfft_valid), dtype=np.complex64  )
@@ -361,7 +554,10 @@ def rd_wh_sac(fnm_wildcard, delta, tmark, t1, t2, npts,
     az   = np.zeros(nsac, dtype=np.float32 )
     baz  = np.zeros(nsac, dtype=np.float32 )
     gcarc= np.zeros(nsac, dtype=np.float32 )
-    ###
+    if nsac <= 0:
+        return None, None, None, None, None, None, None, None
+    ### 1st pass: read all sac files into a single matrix, each row of which is a time series
+    data_mat = np.zeros((nsac, npts), dtype=np.float32)
     index = 0
     for it in fnms:
         st = c_rd_sac(it, tmark, t1, t2, True, False)
@@ -369,35 +565,8 @@ def rd_wh_sac(fnm_wildcard, delta, tmark, t1, t2, npts,
         if (st is None) or (not st.dat.any() ):
             mpi_print_log(mpi_log_fid, 2, True, '+ Failure reading:', it)
             continue
-        ## preproc
-        try:
-            if pre_detrend:
-                st.detrend()
-            if pre_taper_ratio > 1.0e-5:
-                st.taper(pre_taper_ratio)
-            if pre_filter != None:
-                #st.dat = filter(st.dat, sampling_rate, btype, (f1, f2), 2, 2)
-                iirfilter2_f32(st.dat, delta, 0, btype, f1, f2, 2, 2)
-        except:
-            mpi_print_log(mpi_log_fid, 2, True, '+ Failure preproc:', it)
-            continue
-        ## whiten
-        try:
-            if wtlen_sec != None:
-                #st.dat = temporal_normalize(st.dat, sampling_rate, wnd_size_t, w_f1, w_f2, 1.0e-5, whiten_taper_length)
-                tnorm_f32(st.dat, delta, wtlen_sec, w_f1, w_f2, 1.0e-5, whiten_taper_length)
-            if wflen_hz != None:
-                #st.dat = frequency_whiten(st.dat, wnd_size_freq, 1.0e-5, speedup_i1, speedup_i2, whiten_taper_length)
-                fwhiten_f32(st.dat, delta, wflen_hz, 1.0e-5, whiten_taper_length, speedup_i1, speedup_i2)
-        except:
-            mpi_print_log(mpi_log_fid, 2, True, '+ Failure whitening:', it)
-            continue
-        ## check if the whitened data is valid
-        if (not st.dat.any()) or (np.isnan(st.dat).any() ):
-            mpi_print_log(mpi_log_fid, 2, True, '+ Failure whitening:', it)
-            continue
-        ## fft and obtain valid values
-        spectra[index] = pyfftw.interfaces.numpy_fft.rfft(st.dat, fftsize)[:nrfft_valid]
+        n = min(st.dat.size, npts)
+        data_mat[index, :n] = st.dat[:n]
         hdr = st.hdr
         stlo[index] = hdr.stlo
         stla[index] = hdr.stla
@@ -406,22 +575,127 @@ def rd_wh_sac(fnm_wildcard, delta, tmark, t1, t2, npts,
         az[index]   = hdr.az
         baz[index]  = hdr.baz
         gcarc[index]= hdr.gcarc
+        fnms[index] = it # keep the filenames of the rows for logging
         index = index + 1
+    if index <= 0:
+        return None, None, None, None, None, None, None, None
+    nrow = index
+    data_mat = data_mat[:nrow]
+    ### 2nd and 3rd pass: preproc and whiten for all rows at once
+    preproc_args = (npts, pre_detrend, pre_taper_ratio, pre_filter_sos)
+    whiten_args  = (delta, wtlen_sec, w_f1, w_f2, wflen_hz, speedup_i1, speedup_i2, whiten_taper_length)
+    failed = np.zeros(nrow, dtype=bool) # rows that failed in the fallback below and have been logged
+    try:
+        preproc_mat(data_mat, *preproc_args)
+        whiten_mat(data_mat, *whiten_args)
+    except trace_errors as err:
+        # fall back to each row, so that a single bad trace does not discard the others.
+        # the rows are read again, as the failed batch may have processed some of them.
+        mpi_print_log(mpi_log_fid, 2, True, '+ Failure preproc&whitening, retry for each trace:', os.path.dirname(fnms[0]), repr(err) )
+        for irow in range(nrow):
+            row = data_mat[irow:irow+1]
+            row[:] = 0.0
+            st = c_rd_sac(fnms[irow], tmark, t1, t2, True, False)
+            if st is None:
+                mpi_print_log(mpi_log_fid, 2, True, '+ Failure reading:', fnms[irow] )
+                failed[irow] = True
+                continue
+            n = min(st.dat.size, npts)
+            row[0, :n] = st.dat[:n]
+            try:
+                preproc_mat(row, *preproc_args)
+            except trace_errors:
+                mpi_print_log(mpi_log_fid, 2, True, '+ Failure preproc:', fnms[irow] )
+                failed[irow] = True
+                continue
+            try:
+                whiten_mat(row, *whiten_args)
+            except trace_errors:
+                mpi_print_log(mpi_log_fid, 2, True, '+ Failure whitening:', fnms[irow] )
+                failed[irow] = True
+    ## check if the whitened data are valid
+    valid = (~failed) & data_mat.any(axis=1) & (~np.isnan(data_mat).any(axis=1) )
+    for it in np.where(~valid & ~failed)[0]:
+        mpi_print_log(mpi_log_fid, 2, True, '+ Failure whitening:', fnms[it])
+    index = np.count_nonzero(valid)
+    if index <= 0:
+        return None, None, None, None, None, None, None, None
+    stlo, stla, evlo, evla = [it[:nrow][valid] for it in (stlo, stla, evlo, evla)]
+    az, baz, gcarc = [it[:nrow][valid] for it in (az, baz, gcarc)]
+    ### 4th pass: fft for blocks of rows and obtain valid values
+    rows = np.where(valid)[0]
+    time_buf, freq_buf, fft_plan = get_fftw_plan(fftsize, 'FFTW_FORWARD')
+    for i1 in range(0, index, fftw_block_rows):
+        i2 = min(i1+fftw_block_rows, index)
+        n = i2-i1
+        time_buf[:n, :npts] = data_mat[rows[i1:i2]]
+        time_buf[:n, npts:] = 0.0
+        time_buf[n:] = 0.0
+        fft_plan()
+        spectra[i1:i2] = freq_buf[:n, :nrfft_valid]
     ###
-    if 0 < index < nsac:
+    if index < nsac:
         spectra = spectra[:index, :]
-        stlo = stlo[:index]
-        stla = stla[:index]
-        evlo = evlo[:index]
-        evla = evla[:index]
-        az   = az[:index]
-        baz  = baz[:index]
-        gcarc= gcarc[:index]
-    ###
-    if index > 0:
-        return spectra, stlo, stla, evlo, evla, az, baz, gcarc
-    else:
-        return None, None, None, None, None, None, None, None
+    return spectra, stlo, stla, evlo, evla, az, baz, gcarc
+def preproc_mat(data_mat, npts, pre_detrend, pre_taper_ratio, pre_filter_sos):
+    """
+    Inplace detrend, taper and filter for each row of `data_mat`. See `rd_wh_sac(...)` for the parameters.
+    """
+    if pre_detrend:
+        detrend2(data_mat)
+    pre_taper_length = int(npts * pre_taper_ratio)
+    if pre_taper_ratio > 1.0e-5 and pre_taper_length > 0:
+        taper2(data_mat, pre_taper_length)
+    if pre_filter_sos != None:
+        #st.dat = filter(st.dat, sampling_rate, btype, (f1, f2), 2, 2)
+        sosfilter2_f32(data_mat, pre_filter_sos, 2)
+def whiten_mat(data_mat, delta, wtlen_sec, w_f1, w_f2, wflen_hz, speedup_i1, speedup_i2, whiten_taper_length):
+    """
+    Inplace temporal normalization and spectral whitening for each row of `data_mat`. See `rd_wh_sac(...)` for the parameters.
+    """
+    if wtlen_sec != None:
+        #st.dat = temporal_normalize(st.dat, sampling_rate, wnd_size_t, w_f1, w_f2, 1.0e-5, whiten_taper_length)
+        tnorm2_f32(data_mat, delta, wtlen_sec, w_f1, w_f2, 1.0e-5, whiten_taper_length)
+    if wflen_hz != None:
+        #st.dat = frequency_whiten(st.dat, wnd_size_freq, 1.0e-5, speedup_i1, speedup_i2, whiten_taper_length)
+        fwhiten2_f32(data_mat, delta, wflen_hz, 1.0e-5, whiten_taper_length, speedup_i1, speedup_i2)
+def get_fftw_plan(fftsize, direction='FFTW_FORWARD'):
+    """
+    Return (input_buf, output_buf, plan) for the batched rfft/irfft of `fftw_block_rows` rows of `fftsize` points.
+    Larger matrices are transformed block by block, filling only the first rows of the last block
+    (and zeroing the others).
+
+    direction: 'FFTW_FORWARD' for rfft from a float32 (fftw_block_rows, fftsize) buffer
+               into a complex64 (fftw_block_rows, fftsize//2+1) buffer.
+               'FFTW_BACKWARD' for irfft from a complex64 (fftw_block_rows, fftsize//2+1) buffer
+               into a float32 (fftw_block_rows, fftsize) buffer.
+    plan:      the pyfftw.FFTW object. Call `plan()` to transform all rows of `input_buf` into `output_buf`.
+               The content of `input_buf` is destroyed after calling.
+
+    The buffers and the plan are cached and reused for the same (fftsize, direction), so that there is
+    at most one plan for each direction in a run.
+    """
+    key = (fftsize, direction)
+    if key not in fftw_plan_cache:
+        time_buf = pyfftw.empty_aligned((fftw_block_rows, fftsize), dtype='float32')
+        freq_buf = pyfftw.empty_aligned((fftw_block_rows, fftsize//2+1), dtype='complex64')
+        if direction == 'FFTW_FORWARD':
+            buf_in, buf_out = time_buf, freq_buf
+        else:
+            buf_in, buf_out = freq_buf, time_buf
+        plan = pyfftw.FFTW(buf_in, buf_out, axes=(1,), direction=direction,
+                           flags=('FFTW_MEASURE', 'FFTW_DESTROY_INPUT'), threads=fftw_threads )
+        fftw_plan_cache[key] = (buf_in, buf_out, plan)
+    return fftw_plan_cache[key]
+def cores_per_rank(mpi_comm):
+    """
+    Return the number of cores for the threads of this rank, given the ranks sharing the same node.
+    """
+    ncore = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    node_comm = mpi_comm.Split_type(MPI.COMM_TYPE_SHARED)
+    nrank_node = node_comm.Get_size()
+    node_comm.Free()
+    return max(1, min(ncore, os.cpu_count() // nrank_node) )
 def acc_bound(fftsize, sampling_rate, f1, f2, critical_level= 0.001):
     """
     Return the acceleration bound (i1, i2) for spetral computation.
@@ -432,29 +706,56 @@ def acc_bound(fftsize, sampling_rate, f1, f2, critical_level= 0.001):
     df = 1.0/(fftsize*delta)
     fmin, fmax = df, 0.5/delta-df # safe value
     if f1 >= f2 or (f1<=fmin and f2>=fmax) or f1>=fmax or f2 <=fmin:
-        return 0, fftsize
-
-    i1, i2 = 0, fftsize
-    x = np.zeros(fftsize, dtype=np.float32)
-    x[fftsize//2] = 1.0 # Note, cannot use x[0] = 1.0
-    if f1 <=fmin:
-        iirfilter_f32(x, delta, 0, 0, f1, f2, 2, 2)
-        amp = abs( pyfftw.interfaces.numpy_fft.rfft(x, fftsize) )
-        c = amp.max() * critical_level
-        i2 = np.argmax(amp<c)
-    elif f2 >= fmax:
-        iirfilter_f32(x, delta, 0, 1, f1, f2, 2, 2)
-        amp = abs( pyfftw.interfaces.numpy_fft.rfft(x, fftsize) )
-        c = amp.max() * critical_level
-        i1 = np.argmax(amp>c)
-    else:
-        iirfilter_f32(x, delta, 0, 2, f1, f2, 2, 2)
-        amp = abs( pyfftw.interfaces.numpy_fft.rfft(x, fftsize) )
-        c = amp.max() * critical_level
+        return 0, fftsize//2+1
+
+    ### evaluate the amplitude response of the filter at the rfft frequencies, instead of filtering an impulse
+    nrfft = fftsize//2+1
+    freqs = np.arange(nrfft) * df
+    btype = 0 if f1 <= fmin else (1 if f2 >= fmax else 2) # lowpass, highpass, or bandpass
+    amp = sosfreqz_f32(iirdesign_f32(delta, 0, btype, f1, f2, 2), freqs, delta, 2)
+    c = amp.max() * critical_level
+    i1, i2 = 0, nrfft
+    if btype != 0:
         i1 = np.argmax(amp>c)
+    if btype != 1 and (amp[i1:]<c).any():
         i2 = i1 + np.argmax(amp[i1:]<c)
     return i1, i2
 
+@jit(nopython=True, nogil=True, parallel=True)
+def pairwise_dist(lon, lat, gcarc, epdd):
+    """
+    Return the (nsac, nsac) float32 distance matrix for all pairs (isac1, isac2) with isac1 <= isac2.
+    The distance is the inter-point great-circle distance, or the epi-distance difference if `epdd` is True.
+    Only the upper triangle (including the diagonal) is filled.
+    """
+    nsac = lon.size
+    dist_mat = np.zeros((nsac, nsac), dtype=np.float32)
+    for isac1 in prange(nsac):
+        lo1, la1, gcarc1 = lon[isac1], lat[isac1], gcarc[isac1]
+        for isac2 in range(isac1, nsac):
+            if epdd:
+                dist_mat[isac1, isac2] = abs(gcarc1-gcarc[isac2])
+            else:
+                dist_mat[isac1, isac2] = geomath.haversine(lo1, la1, lon[isac2], lat[isac2])
+    return dist_mat
+@jit(nopython=True, nogil=True, parallel=True)
+def dist_index(dist_mat, nrow, dist_min, dist_max, dist_step):
+    """
+    Return the (nsac, nsac) int32 matrix of the stack bin index for the upper triangle of `dist_mat`.
+    Pairs outside the stack distance range, and the lower triangle, are marked with -1.
+    """
+    nsac = dist_mat.shape[0]
+    d1, d2 = dist_min-dist_step*0.5, dist_max+dist_step*0.5
+    idx_mat = np.full((nsac, nsac), -1, dtype=np.int32)
+    for isac1 in prange(nsac):
+        for isac2 in range(isac1, nsac):
+            dist = dist_mat[isac1, isac2]
+            if dist > d2 or dist < d1:
+                continue
+            idx = int( np.round((dist-dist_min) / dist_step) )
+            if 0 <= idx < nrow:
+                idx_mat[isac1, isac2] = idx
+    return idx_mat
 @jit(nopython=True, nogil=True)
 def spec_ccstack(spec_mat, lon, lat, gcarc, epdd, stack_mat, stack_count, 
                     dist_min, dist_max, dist_step, acc_idx_min, acc_idx_max, random_sample):
@@ -470,33 +771,193 @@ def spec_ccstack(spec_mat, lon, lat, gcarc, epdd, stack_mat, stack_count,
     Return:
         count: The number of correlation functions that are stacked.
     """
-    count = 0
-    i1, i2 = acc_idx_min, acc_idx_max
     nrow = stack_mat.shape[0]
-    d1, d2 = dist_min-dist_step*0.5, dist_max+dist_step*0.5
-    nsac = spec_mat.shape[0]
-    for isac1 in range(nsac):
-        lo1, la1, gcarc1 = lon[isac1], lat[isac1], gcarc[isac1]
-        spec1 = spec_mat[isac1]
+    idx_mat = dist_index(pairwise_dist(lon, lat, gcarc, epdd), nrow, dist_min, dist_max, dist_step)
+    pairs = index_to_pairs(idx_mat, random_sample)
+    return pairs_ccstack(spec_mat, pairs, stack_mat, stack_count, acc_idx_min, acc_idx_max)
+@jit(nopython=True, nogil=True, parallel=True)
+def index_to_pairs(idx_mat, random_sample):
+    """
+    Return a (npair, 3) int32 array of (isac1, isac2, idx) for all valid pairs in `idx_mat` (see `dist_index(...)`).
+    Pairs are randomly dropped if `0 < random_sample < 1`, and are marked with -1 in `idx_mat` in place.
+    """
+    nsac = idx_mat.shape[0]
+    ### (1) count the valid pairs for each isac1
+    row_count = np.zeros(nsac, dtype=np.int64)
+    for isac1 in prange(nsac):
+        n = 0
         for isac2 in range(isac1, nsac):
-            lo2, la2, gcarc2 = lon[isac2], lat[isac2], gcarc[isac2]
-            spec2 = spec_mat[isac2]
-            ###
-            dist = abs(gcarc1-gcarc2)
-            if not epdd:
-                dist = geomath.haversine(lo1, la1, lo2, la2)
-            if dist > d2 or dist < d1:
-                continue
-            idx = int( np.round((dist-dist_min) / dist_step) )
-            if idx < 0 or idx >= nrow:
+            if idx_mat[isac1, isac2] < 0:
                 continue
             if 0 < random_sample and  random_sample < rand(): # randomly resample
+                idx_mat[isac1, isac2] = -1
+                continue
+            n += 1
+        row_count[isac1] = n
+    ### (2) write the pairs of each isac1 from the cumulative offsets
+    offset = np.zeros(nsac+1, dtype=np.int64)
+    offset[1:] = np.cumsum(row_count)
+    pairs = np.empty((offset[-1], 3), dtype=np.int32)
+    for isac1 in prange(nsac):
+        ipair = offset[isac1]
+        for isac2 in range(isac1, nsac):
+            idx = idx_mat[isac1, isac2]
+            if idx < 0:
                 continue
-            w   = np.conj(spec1[i1:i2]) * spec2[i1:i2]
-            stack_mat[idx][i1:i2] += w
-            stack_count[idx] += 1
-            count += 1
-    return count
+            pairs[ipair, 0] = isac1
+            pairs[ipair, 1] = isac2
+            pairs[ipair, 2] = idx
+            ipair += 1
+    return pairs
+@jit(nopython=True, nogil=True, parallel=True, fastmath=True)
+def pairs_ccstack(spec_mat, pairs, stack_mat, stack_count, acc_idx_min, acc_idx_max):
+    """
+    Cross-correlation and stacking for a list of pairs, without any selection inside the loop.
+
+    spec_mat:    Input spectra that is a 2D matrix. Each row is for a single time series.
+    pairs:       (npair, 3) int32 array of (isac1, isac2, idx). See `index_to_pairs(...)`.
+    stack_mat:   The correlation spectra for stacking.
+    stack_count: A 1D array to store number of stacks for each stack bin.
+    acc_idx_min, acc_idx_max:
+
+    Return:
+        count: The number of correlation functions that are stacked.
+    """
+    i1, i2 = acc_idx_min, acc_idx_max
+    nrow = stack_mat.shape[0]
+    npair = pairs.shape[0]
+    conj_spec = np.conj(spec_mat[:, i1:i2])
+    ### thread-private accumulators of a single tile to avoid racing on the same stack bin
+    nthreads = get_num_threads()
+    local_stack_mat   = np.zeros((nthreads, nrow, min(cc_tile_size, i2-i1)), dtype=np.complex64)
+    ### loop over frequency tiles outside, so that the spectra of a tile are reused from cache by all pairs
+    for k1 in range(0, i2-i1, cc_tile_size):
+        k2 = min(k1+cc_tile_size, i2-i1)
+        for ipair in prange(npair):
+            tid = get_thread_id()
+            isac1, isac2, idx = pairs[ipair, 0], pairs[ipair, 1], pairs[ipair, 2]
+            conj_spec1 = conj_spec[isac1]
+            spec2 = spec_mat[isac2, i1:i2]
+            stack_row = local_stack_mat[tid, idx]
+            for k in range(k1, k2):
+                stack_row[k-k1] += conj_spec1[k] * spec2[k]
+        ### reduce the tile, and clear the accumulators for the next tile
+        for irow in prange(nrow):
+            for tid in range(nthreads):
+                stack_mat[irow, i1+k1:i1+k2] += local_stack_mat[tid, irow, :k2-k1]
+                local_stack_mat[tid, irow, :] = 0.0
+    for ipair in range(npair):
+        stack_count[pairs[ipair, 2]] += 1
+    return npair
+@jit(nopython=True, nogil=True, parallel=True)
+def quantize_spec(spec_mat, acc_idx_min, acc_idx_max):
+    """
+    Quantize the spectra `spec_mat[:, acc_idx_min:acc_idx_max]` into complex-int16 with a scale for each row.
+
+    Return:
+        qspec: (nsac, 2*(acc_idx_max-acc_idx_min)) int16 matrix that is the real/imag interleaved quantized spectra.
+        scale: (nsac) float32 array so that `spec_mat[isac, acc_idx_min+k] ~= (qspec[isac, 2k] + 1j*qspec[isac, 2k+1]) * scale[isac]`.
+    """
+    i1, i2 = acc_idx_min, acc_idx_max
+    nsac, nk = spec_mat.shape[0], i2-i1
+    qspec = np.zeros((nsac, 2*nk), dtype=np.int16)
+    scale = np.zeros(nsac, dtype=np.float32)
+    for isac in prange(nsac):
+        row = spec_mat[isac, i1:i2]
+        vmax = 0.0
+        for k in range(nk):
+            vmax = max(vmax, abs(row[k].real), abs(row[k].imag) )
+        if vmax <= 0.0:
+            continue
+        scale[isac] = vmax / 32767.0
+        f = 32767.0 / vmax
+        for k in range(nk):
+            qspec[isac, 2*k]   = np.int16( np.round(row[k].real * f) )
+            qspec[isac, 2*k+1] = np.int16( np.round(row[k].imag * f) )
+    return qspec, scale
+@jit(nopython=True, nogil=True, parallel=True, fastmath=True)
+def pairs_ccstack_i16(qspec, scale, pairs, stack_mat, stack_count, acc_idx_min, acc_idx_max):
+    """
+    The same as `pairs_ccstack(...)`, but with the quantized spectra from `quantize_spec(...)`.
+    The int16 values are converted to float32 on the fly, and the stacks are in float32.
+    """
+    i1, i2 = acc_idx_min, acc_idx_max
+    nrow = stack_mat.shape[0]
+    npair = pairs.shape[0]
+    nk = i2-i1
+    ### thread-private accumulators of a single tile to avoid racing on the same stack bin
+    nthreads = get_num_threads()
+    local_stack_re    = np.zeros((nthreads, nrow, min(cc_tile_size, nk)), dtype=np.float32)
+    local_stack_im    = np.zeros((nthreads, nrow, min(cc_tile_size, nk)), dtype=np.float32)
+    ### loop over frequency tiles outside, so that the spectra of a tile are reused from cache by all pairs
+    for k1 in range(0, nk, cc_tile_size):
+        k2 = min(k1+cc_tile_size, nk)
+        for ipair in prange(npair):
+            tid = get_thread_id()
+            isac1, isac2, idx = pairs[ipair, 0], pairs[ipair, 1], pairs[ipair, 2]
+            q1, q2 = qspec[isac1], qspec[isac2]
+            s = scale[isac1] * scale[isac2]
+            stack_re, stack_im = local_stack_re[tid, idx], local_stack_im[tid, idx]
+            for k in range(k1, k2):
+                re1, im1 = np.float32(q1[2*k]), np.float32(q1[2*k+1])
+                re2, im2 = np.float32(q2[2*k]), np.float32(q2[2*k+1])
+                # conj(s1) * s2
+                stack_re[k-k1] += s * (re1*re2 + im1*im2)
+                stack_im[k-k1] += s * (re1*im2 - im1*re2)
+        ### reduce the tile, and clear the accumulators for the next tile
+        for irow in prange(nrow):
+            for tid in range(nthreads):
+                stack_mat[irow, i1+k1:i1+k2] += local_stack_re[tid, irow, :k2-k1] + 1j*local_stack_im[tid, irow, :k2-k1]
+                local_stack_re[tid, irow, :] = 0.0
+                local_stack_im[tid, irow, :] = 0.0
+    for ipair in range(npair):
+        stack_count[pairs[ipair, 2]] += 1
+    return npair
+@cuda.jit
+def cu_ccstack_kernel(spec, pairs, stack):
+    """
+    CUDA kernel for cross-correlation and stacking. Each block is for a single pair.
+
+    spec:  (nsac, 2*nk) float32 matrix that is the real/imag interleaved view of the complex64 spectra.
+    pairs: (npair, 3) int32 array of (isac1, isac2, idx).
+    stack: (nrow, 2*nk) float32 matrix that is the real/imag interleaved view of the complex64 stacks.
+    """
+    ipair = cuda.blockIdx.x
+    isac1, isac2, idx = pairs[ipair, 0], pairs[ipair, 1], pairs[ipair, 2]
+    nk = spec.shape[1] // 2
+    k = cuda.threadIdx.x
+    while k < nk:
+        re1, im1 = spec[isac1, 2*k], spec[isac1, 2*k+1]
+        re2, im2 = spec[isac2, 2*k], spec[isac2, 2*k+1]
+        # conj(s1) * s2
+        cuda.atomic.add(stack, (idx, 2*k),   re1*re2 + im1*im2)
+        cuda.atomic.add(stack, (idx, 2*k+1), re1*im2 - im1*re2)
+        k += cuda.blockDim.x
+def cu_spec_ccstack(spec_mat, pairs, stack_mat, stack_count, acc_idx_min, acc_idx_max, threads_per_block=128):
+    """
+    Cross-correlation and stacking on CUDA devices.
+
+    spec_mat:    Input spectra that is a 2D matrix. Each row is for a single time series.
+    pairs:       (npair, 3) int32 array of (isac1, isac2, idx). See `index_to_pairs(...)`.
+    stack_mat:   The correlation spectra for stacking.
+    stack_count: A 1D array to store number of stacks for each stack bin.
+    acc_idx_min, acc_idx_max:
+
+    Return:
+        count: The number of correlation functions that are stacked.
+    """
+    npair = pairs.shape[0]
+    if npair <= 0:
+        return 0
+    i1, i2 = acc_idx_min, acc_idx_max
+    nrow = stack_mat.shape[0]
+    d_spec  = cuda.to_device( np.ascontiguousarray(spec_mat[:, i1:i2]).view(np.float32) )
+    d_pairs = cuda.to_device( np.ascontiguousarray(pairs) )
+    d_stack = cuda.to_device( np.zeros((nrow, 2*(i2-i1)), dtype=np.float32) )
+    cu_ccstack_kernel[npair, threads_per_block](d_spec, d_pairs, d_stack)
+    stack_mat[:, i1:i2] += d_stack.copy_to_host().view(np.complex64)
+    stack_count += np.bincount(pairs[:, 2], minlength=nrow).astype(np.int32)
+    return npair
 @jit(nopython=True, nogil=True)
 def sph_center_triple_pts(pt_lon, pt_lat, lo1, la1, lo2, la2):
     """
@@ -511,12 +972,50 @@ def sph_center_triple_pts(pt_lon, pt_lat, lo1, la1, lo2, la2):
     return clo%360, cla
 @jit(nopython=True, nogil=True)
 def round_daz(daz):
-    daz = daz % 360
-    if daz > 180.0:
-        daz = 360.0-daz
-    if daz > 90.0:
-        daz = 180.0-daz
-    return daz
+    ### branchless form of `daz%360; if daz>180: daz=360-daz; if daz>90: daz=180-daz`
+    daz = daz - 360.0*np.floor(daz*(1.0/360.0) )
+    daz = min(daz, 360.0-daz)
+    return min(daz, 180.0-daz)
+@jit(nopython=True, nogil=True, parallel=True)
+def select_pairs(idx_mat, lon, lat, azimuth, pt_lon, pt_lat, daz_min, daz_max, gcd_min, gcd_max,
+                    rect_clo1, rect_clo2, rect_cla1, rect_cla2,
+                    circle_center_clo, circle_center_cla, circle_center_radius):
+    """
+    Mark the pairs in `idx_mat` (see `dist_index(...)`) that fail any of the selection criteria with -1, in place.
+    See `spec_ccstack2(...)` for the parameters.
+    """
+    nsac = idx_mat.shape[0]
+    for isac1 in prange(nsac):
+        lo1, la1, az1 = lon[isac1], lat[isac1], azimuth[isac1]
+        for isac2 in range(isac1, nsac):
+            if idx_mat[isac1, isac2] < 0:
+                continue
+            lo2, la2, az2 = lon[isac2], lat[isac2], azimuth[isac2]
+            ### rect and circle selection
+            clo, cla = sph_center_triple_pts(pt_lon, pt_lat, lo1, la1, lo2, la2)
+            flag = 1 # 1 means the (clo, cla) is out of any rectangles
+            for clo1, clo2, cla1, cla2 in zip(rect_clo1, rect_clo2, rect_cla1, rect_cla2):
+                if (cla1<=cla<=cla2) and ( clo1<=clo<=clo2 or (clo1>clo2 and (clo>=clo1 or clo<=clo2)) ):
+                    flag = 0
+                    break
+            if flag == 0:
+                flag = 1 # 1 means the (clo, cla) is out of any circles
+                for cclo, ccla, cradius in zip(circle_center_clo, circle_center_cla, circle_center_radius):
+                    if geomath.haversine(clo, cla, cclo, ccla) <= cradius:
+                        flag = 0
+                        break
+            ### daz selection
+            if flag == 0:
+                daz = round_daz(az1-az2)
+                if daz < daz_min or daz > daz_max:
+                    flag = 1
+            ### gcd selection
+            if flag == 0:
+                gcd = abs( geomath.point_distance_to_great_circle_plane(pt_lon, pt_lat, lo1, la1, lo2, la2) )
+                if gcd < gcd_min or gcd > gcd_max:
+                    flag = 1
+            if flag == 1:
+                idx_mat[isac1, isac2] = -1
 @jit(nopython=True, nogil=True)
 def spec_ccstack2(spec_mat, lon, lat, gcarc, epdd, stack_mat, stack_count, 
                     dist_min, dist_max, dist_step, acc_idx_min, acc_idx_max,
@@ -542,109 +1041,67 @@ def spec_ccstack2(spec_mat, lon, lat, gcarc, epdd, stack_mat, stack_count,
         count: The number of correlation functions that are stacked.
     """
     nrow = stack_mat.shape[0]
-    dist1, dist2 = dist_min-dist_step*0.5, dist_max+dist_step*0.5
-    count = 0
-    i1, i2 = acc_idx_min, acc_idx_max
-    nsac = spec_mat.shape[0]
-    for isac1 in range(nsac):
-        lo1, la1, az1, gcarc1 = lon[isac1], lat[isac1], azimuth[isac1], gcarc[isac1]
-        spec1 = spec_mat[isac1]
-        for isac2 in range(isac1, nsac):
-            lo2, la2, az2, gcarc2 = lon[isac2], lat[isac2], azimuth[isac2], gcarc[isac2]
-            ### dist selection
-            dist = abs(gcarc1-gcarc2)
-            if not epdd:
-                dist = geomath.haversine(lo1, la1, lo2, la2)
-            if dist < dist1 or dist > dist2:
-                continue
-            idx = int( np.round((dist-dist_min) / dist_step) )
-            if idx<0 or idx>nrow:
-                continue
-            ### rect and circle selection
-            flag = 1 # 1 means the (clo, cla) is out of any rectangles
-            clo, cla = sph_center_triple_pts(pt_lon, pt_lat, lo1, la1, lo2, la2)
-            for clo1, clo2, cla1, cla2 in zip(rect_clo1, rect_clo2, rect_cla1, rect_cla2):
-                if (cla1<=cla<=cla2) and ( clo1<=clo<=clo2 or (clo1>clo2 and (clo>=clo1 or clo<=clo2)) ):
-                    flag = 0
-                    break
-            if flag == 1:
-                continue
-
-            flag = 1 # 1 means the (clo, cla) is out of any circles
-            for cclo, ccla, cradius in zip(circle_center_clo, circle_center_cla, circle_center_radius):
-                if geomath.haversine(clo, cla, cclo, ccla) <= cradius:
-                    flag = 0
-                    break
-            if flag == 1:
-                continue
-            ### daz selection
-            daz = round_daz(az1-az2)
-            if daz < daz_min or daz > daz_max:
-                continue
-            ### gcd selection
-            gcd = abs( geomath.point_distance_to_great_circle_plane(pt_lon, pt_lat, lo1, la1, lo2, la2) )
-            if gcd < gcd_min or gcd > gcd_max:
-                continue
-            ###
-            if 0 < random_sample and  random_sample < rand(): # randomly resample
-                continue
-            spec2 = spec_mat[isac2]
-            ###
-            w   = np.conj(spec1[i1:i2]) * spec2[i1:i2]
-            stack_mat[idx][i1:i2] += w
-            stack_count[idx] += 1
-            count += 1
-    return count
+    ### selections are evaluated once for all pairs, and then the valid pairs are stacked without branches
+    idx_mat = dist_index(pairwise_dist(lon, lat, gcarc, epdd), nrow, dist_min, dist_max, dist_step)
+    select_pairs(idx_mat, lon, lat, azimuth, pt_lon, pt_lat, daz_min, daz_max, gcd_min, gcd_max,
+                    rect_clo1, rect_clo2, rect_cla1, rect_cla2,
+                    circle_center_clo, circle_center_cla, circle_center_radius)
+    pairs = index_to_pairs(idx_mat, random_sample)
+    return pairs_ccstack(spec_mat, pairs, stack_mat, stack_count, acc_idx_min, acc_idx_max)
 def post_proc(spec_stack_mat, absolute_amp, fftsize, npts, delta,
-                post_fold, post_taper_ratio, post_filter, post_norm, post_cut,
+                post_fold, post_taper_ratio, post_filter_sos, post_norm, post_cut,
                 mpi_log_fid):
     """
     """
     if True:
         mpi_print_log(mpi_log_fid, 0, False, 'Ifft', )
-        mpi_print_log(mpi_log_fid, 1, True,  'fftsize: ', fftsize, '(we will later get rid of the useless ZERO point in the cross-correlation.)')
+        mpi_print_log(mpi_log_fid, 1, False,  'fftsize: ', fftsize, '(we will later keep only the 2*npts-1 lags of the linear cross-correlation.)')
     rollsize = npts-1
-    nbin = spec_stack_mat.shape[0]
-    time_mat = np.zeros( (nbin, fftsize-1), dtype=np.float32 )
-    ### ifft
-    for irow in range(nbin):
-        spec_stack_mat[irow][0] = 0.0 # set the DC component to zero
-        junk = pyfftw.interfaces.numpy_fft.irfft(spec_stack_mat[irow], fftsize)
-        junk = np.roll(junk, rollsize)
-        time_mat[irow] = junk[:-1] # get rid of the zero point
+    nbin, nvalid = spec_stack_mat.shape
+    time_mat = np.empty( (nbin, 2*rollsize+1), dtype=np.float32 ) # fully overwritten by the two slice copies below
+    ### ifft for blocks of rows
+    spec_stack_mat[:, 0] = 0.0 # set the DC component to zero
+    spec_buf, full_mat, ifft_plan = get_fftw_plan(fftsize, 'FFTW_BACKWARD')
+    for i1 in range(0, nbin, fftw_block_rows):
+        i2 = min(i1+fftw_block_rows, nbin)
+        n = i2-i1
+        spec_buf[:n, :nvalid] = spec_stack_mat[i1:i2]
+        spec_buf[:n, nvalid:] = 0.0
+        spec_buf[n:] = 0.0
+        ifft_plan()
+        # negative lags are at the end of the irfft output, and zero and positive lags at the beginning.
+        # lags outside (-rollsize, rollsize) are only zero padding.
+        time_mat[i1:i2, :rollsize] = full_mat[:n, fftsize-rollsize:]
+        time_mat[i1:i2, rollsize:] = full_mat[:n, :rollsize+1]
     ### post processing
     if True:
-        mpi_print_log(mpi_log_fid, 0, True, 'Post processing...' )
+        mpi_print_log(mpi_log_fid, 0, False, 'Post processing...' )
     # 4.1 post processing fold
     cc_t1, cc_t2 = -rollsize*delta, rollsize*delta
     if post_fold:
-        mpi_print_log(mpi_log_fid, 1, True, 'Folding...' )
-        for irow in range(nbin):
-            time_mat[irow] += time_mat[irow][::-1]
-        time_mat = time_mat[:,rollsize:]
+        mpi_print_log(mpi_log_fid, 1, False, 'Folding...' )
+        time_mat += time_mat[:, ::-1]
+        time_mat = np.ascontiguousarray(time_mat[:,rollsize:])
         cc_t1, cc_t2 = 0, rollsize*delta
     # 4.2 post filtering
-    if post_filter:
-        sampling_rate = 1.0/delta
+    if post_filter_sos != None:
         junk = int(post_taper_ratio * time_mat.shape[1])
-        mpi_print_log(mpi_log_fid, 1, True,  'Tapering ... ', post_taper_ratio, 'size:', junk )
-        mpi_print_log(mpi_log_fid, 1, False, 'Filtering... ', post_filter )
-        btype, f1, f2 = post_filter
-        for irow in range(nbin):
-            #time_mat[irow] = filter(time_mat[irow], sampling_rate, btype, (f1, f2), 2, 2 )
-            taper(time_mat[irow], junk)
-            iirfilter_f32(time_mat[irow], delta, 0, btype, f1, f2, 2, 2)
+        mpi_print_log(mpi_log_fid, 1, False,  'Tapering ... ', post_taper_ratio, 'size:', junk )
+        mpi_print_log(mpi_log_fid, 1, False, 'Filtering... ' )
+        # the taper weights and the filter are designed once and applied to all rows
+        if junk > 0:
+            taper2(time_mat, junk)
+        sosfilter2_f32(time_mat, post_filter_sos, 2)
     # 4.3 post norm
     if post_norm:
-        mpi_print_log(mpi_log_fid, 1, True, 'Post normalizing... ' )
-        for irow in range(nbin):
-            v = time_mat[irow].max()
-            if v> 0.0:
-                time_mat[irow] *= (1.0/v)
-                absolute_amp[irow] = v
+        mpi_print_log(mpi_log_fid, 1, False, 'Post normalizing... ' )
+        peaks = time_mat.max(axis=1)
+        valid = peaks > 0.0
+        time_mat[valid] *= (1.0/peaks[valid])[:, np.newaxis]
+        absolute_amp[valid] = peaks[valid]
     # 4.4 post cut
-    if post_cut != None:
-        mpi_print_log(mpi_log_fid, 1, True, 'Post cutting... ', post_cut )
+    if post_cut is not None:
+        mpi_print_log(mpi_log_fid, 1, False, 'Post cutting... ', post_cut )
         post_t1, post_t2 = post_cut
         post_t1 = cc_t1 if post_t1 < cc_t1 else post_t1
         post_t2 = cc_t2 if post_t2 > cc_t2 else post_t2
@@ -671,7 +1128,8 @@ def output( stack_mat, stack_count, dist, absolute_amp,
         if True:
             mpi_print_log(mpi_log_fid, 1, True, 'hdf5: ', h5_fnm)
         f = h5py.File(h5_fnm, 'w' )
-        dset = f.create_dataset('ccstack', data=stack_mat )
+        # chunks of a single row (or a part of it) are compressed separately
+        dset = f.create_dataset('ccstack', data=stack_mat, chunks=(1, min(4096, stack_mat.shape[1]) ), **h5_ccstack_filters )
         dset.attrs['cc_t0'] = cc_t1
         dset.attrs['cc_t1'] = cc_t2
         dset.attrs['delta'] = delta
@@ -691,13 +1149,62 @@ def output( stack_mat, stack_count, dist, absolute_amp,
             c_wrt_sac(fnm, stack_mat[irow], out_hdr, True)
     pass
 
+def output_mpi( stack_mat, row_range, stack_count, dist, absolute_amp,
+            cc_t1, cc_t2, delta,
+            output_fnm_prefix, output_format,
+            mpi_comm, mpi_log_fid):
+    """
+    Collective output with parallel hdf5. Each rank outputs its own rows.
+
+    stack_mat, absolute_amp: the rows (row_range[0], row_range[1]) of the full correlation stacks.
+    stack_count, dist:       for all the rows.
+    """
+    row1, row2 = row_range
+    if True:
+        mpi_print_log(mpi_log_fid, 0, False, 'Outputting (parallel)...', output_format, 'rows:', row_range)
+    if 'hdf5' in output_format or 'h5' in output_format:
+        h5_fnm = '%s.h5' % (output_fnm_prefix)
+        if True:
+            mpi_print_log(mpi_log_fid, 1, True, 'hdf5: ', h5_fnm)
+        f = h5py.File(h5_fnm, 'w', driver='mpio', comm=mpi_comm)
+        # chunks of a single row (or a part of it), so that no chunk is shared by two ranks.
+        # the same filters as `output(...)`, but filters with parallel writes need HDF5>=1.10.2.
+        filters = h5_ccstack_filters if h5py.version.hdf5_version_tuple >= (1, 10, 2) else dict()
+        dset = f.create_dataset('ccstack', (dist.size, stack_mat.shape[1]), dtype=stack_mat.dtype,
+                                chunks=(1, min(4096, stack_mat.shape[1]) ), **filters )
+        # attributes and dataset creation are collective, so all ranks set the same values
+        dset.attrs['cc_t0'] = cc_t1
+        dset.attrs['cc_t1'] = cc_t2
+        dset.attrs['delta'] = delta
+        dset_count = f.create_dataset('stack_count', stack_count.shape, dtype=stack_count.dtype )
+        dset_amp   = f.create_dataset('absolute_amp', (dist.size,), dtype=absolute_amp.dtype )
+        dset_dist  = f.create_dataset('dist', dist.shape, dtype=dist.dtype )
+        with dset.collective:
+            dset[row1:row2, :] = stack_mat
+        with dset_amp.collective:
+            dset_amp[row1:row2] = absolute_amp
+        if mpi_comm.Get_rank() == 0:
+            dset_count[:] = stack_count
+            dset_dist[:] = dist
+        f.close()
+    if 'sac' in output_format or 'SAC' in output_format:
+        out_hdr = c_mk_sachdr_time(cc_t1, delta, 1)
+        if True:
+            mpi_print_log(mpi_log_fid, 1, True, 'sac:  ', '%s_..._sac' % (output_fnm_prefix))
+        for irow in range(row1, row2):
+            fnm = '%s_%05.1f_.sac' % (output_fnm_prefix, dist[irow])
+            out_hdr.user2 = dist[irow]
+            out_hdr.user3 = stack_count[irow]
+            out_hdr.user4 = absolute_amp[irow-row1]
+            c_wrt_sac(fnm, stack_mat[irow-row1], out_hdr, True)
+
 HMSG = """%s  -I "in*/*.sac" -T -5/10800/32400 -D 0.1 -O cc_stack --out_format hdf5
     [--pre_detrend] [--pre_taper 0.005] [--pre_filter bandpass/0.005/0.1] 
     --stack_dist 0/180/1 [--daz -0.1/15] [--gcd -0.1/20] [--gc_center_rect 120/180/0/40,180/190/0/10]
     [--gc_center_circle 100/-20/10,90/0/15] [--min_recordings 10] [--epdd]
     [--w_temporal 128.0/0.02/0.06667] [--w_spec 0.02] 
     [--post_fold] [--post_taper 0.05] [--post_filter bandpass/0.02/0.0666] [--post_norm] [--post_cut]
-     --log cc_log  [--log_mode 0] [--acc=0.001] [--random_sample 0.6]
+     --log cc_log  [--log_mode 0] [--log_level 1] [--acc=0.001] [--random_sample 0.6] [--gpu] [--spec_int16]
 
 Args:
     #0. Mode:
@@ -713,6 +1220,8 @@ Args:
     
     -O  : output filename prefix.
     --out_format:  output formate (can be 'hdf5' or 'sac', or 'hdf5,sac' ).
+                   The hdf5 `ccstack` dataset is stored in chunks of rows with the standard gzip(level 1)
+                   and shuffle filters (uncompressed for parallel hdf5 older than 1.10.2).
 
     #2. whitening parameter.
     [--w_temporal] : temporal normalization. (default is disabled)
@@ -740,10 +1249,14 @@ Args:
     --log : log filename prefix.
     --log_mode :
                 E.g.: `--log_mode=all`, `--log_mode=0`, `--log_mode=0,1,2,3,10`.
+    --log_level : verbose level of logging (default is 2).
+                0: section titles; 1: parameters and summaries; 2: each job.
 
     #6. Other options:
     --acc : acceleration threshold. (default is 0.001)
     --random_sample : random resample the cross-correlation functions in the stacking.  (a value between 0 and 1)
+    --gpu : run the cross-correlation and stacking on CUDA devices.
+    --spec_int16 : quantize the spectra into complex-int16 for the cross-correlation and stacking on CPU.
 
 E.g.,
     %s --mode r2r -I "in*/*.sac" -T -5/10800/32400 -D 0.1 --pre_detrend --pre_taper 0.005
@@ -755,6 +1268,11 @@ E.g.,
         --log cc_log --log_mode=0 --acc 0.01
 
     """
+def _parse_f64(arg, sep='/'):
+    """
+    Parse a command line value like `0.1/20` into a 1D array of float64.
+    """
+    return np.array( [float(it) for it in arg.split(sep) ], dtype=np.float64 )
 if __name__ == "__main__":
     mode = 'r2r'
 
@@ -789,9 +1307,12 @@ if __name__ == "__main__":
 
     log_prefnm= 'cc_mpi_log'
     log_mode  = None
+    log_level = 2
 
     spec_acc_threshold = 0.01
     random_sample = -1.0
+    use_gpu = False
+    spec_int16 = False
     ######################
     if len(sys.argv) <= 1:
         print(HMSG % (sys.argv[0], sys.argv[0]), flush=True)
@@ -805,7 +1326,7 @@ if __name__ == "__main__":
                              'w_temporal=', 'w_spec=',
                              'stack_dist=', 'daz=', 'dbaz=', 'gcd=', 'gcd_ev=', 'gcd_rcv=', 'gc_center_rect=', 'gc_center_circle=', 'min_recordings=', 'min_ev_per_rcv=', 'min_rcv_per_ev=', 'epdd=',
                              'post_fold', 'post_taper=', 'post_filter=', 'post_norm', 'post_cut=',
-                             'log=', 'log_mode=', 'acc=', 'random_sample='] )
+                             'log=', 'log_mode=', 'log_level=', 'acc=', 'random_sample=', 'gpu', 'spec_int16'] )
     for opt, arg in options:
         if opt in ('--mode'):
             mode = arg
@@ -833,27 +1354,27 @@ if __name__ == "__main__":
         elif opt in ('--out_format'):
             output_format = arg.split(',')
         elif opt in ('--w_temporal'):
-            tnorm = tuple( [float(it) for it in arg.split('/') ] )
+            tnorm = _parse_f64(arg)
         elif opt in ('--w_spec'):
             swht = float(arg)
         elif opt in ('--stack_dist'):
-            x, y, z = [float(it) for it in arg.split('/') ]
+            x, y, z = _parse_f64(arg)
             dist_range, dist_step = (x, y), z
         elif opt in ('--daz', '--dbaz'):
-            daz_range = [float(it) for it in arg.split('/') ]
+            daz_range = _parse_f64(arg)
         elif opt in ('--gcd_ev', '--gcd', '--gcd_rcv'):
-            gcd_range = [float(it) for it in arg.split('/') ]
+            gcd_range = _parse_f64(arg)
         elif opt in ('--gc_center_rect'):
             gc_center_rect = []
             for rect in arg.split(','):
-                tmp = [float(it) for it in rect.split('/') ]
+                tmp = _parse_f64(rect)
                 tmp[0] = tmp[0] % 360.0
                 tmp[1] = tmp[1] % 360.0
                 gc_center_rect.append( tmp )
         elif opt in ('--gc_center_circle'):
             gc_center_circle = []
             for rect in arg.split(','):
-                tmp = [float(it) for it in rect.split('/') ]
+                tmp = _parse_f64(rect)
                 tmp[0] = tmp[0] % 360.0
                 gc_center_circle.append( tmp )
         elif opt in ('--min_recordings', '--min_ev_per_rcv', '--min_rcv_per_ev'):
@@ -871,7 +1392,7 @@ if __name__ == "__main__":
         elif opt in ('--post_norm'):
             post_norm = True
         elif opt in ('--post_cut'):
-            post_cut = tuple( [float(it) for it in arg.split('/') ] )
+            post_cut = _parse_f64(arg)
         elif opt in ('--log'):
             log_prefnm = arg
         elif opt in ('--log_mode'):
@@ -881,18 +1402,28 @@ if __name__ == "__main__":
                 log_mode = [0]
             else:
                 log_mode = [int(it) for it in arg.split(',') ]
+        elif opt in ('--log_level'):
+            log_level = int(arg)
         elif opt in ('--acc'):
             spec_acc_threshold = float(arg)
         elif opt in ('--random_sample'):
             random_sample = float(arg)
+        elif opt in ('--gpu'):
+            use_gpu = True
+        elif opt in ('--spec_int16'):
+            spec_int16 = True
     #######
-    main(mode, fnm_wildcard, tmark, t1, t2, delta, input_format,
+    try:
+        main(mode, fnm_wildcard, tmark, t1, t2, delta, input_format,
                 pre_detrend, pre_taper_ratio, pre_filter, 
                 tnorm, swht, dist_range, dist_step, 
                 daz_range, gcd_range, gc_center_rect, gc_center_circle, min_recordings, epdd,
                 post_fold, post_taper_ratio, post_filter, post_norm, post_cut, 
                 output_pre_fnm, output_format, 
-                log_prefnm, log_mode, spec_acc_threshold, random_sample)
+                log_prefnm, log_mode, spec_acc_threshold, random_sample, use_gpu, log_level, spec_int16)
+    finally:
+        # in case of fatal errors, before MPI aborts and the atexit hooks may not run
+        mpi_flush_log()
     ########
 
 
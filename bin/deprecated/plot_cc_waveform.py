@@ -85,7 +85,8 @@ def run(h5_filename, figname, dist_range=None, cc_time_range=None, lines= None,
         tmp = stack_count[stack_count>0]
         ax2.bar(dist, stack_count, align='center', color='gray', width= dist[1]-dist[0] )
         ax2.set_xlim(dist_range)
-        ax2.set_ylim((0, sorted(tmp)[-2] * 1.1) )
+        ymax = np.partition(tmp, -2)[-2] if tmp.size >= 2 else tmp.max()
+        ax2.set_ylim((0, ymax * 1.1) )
         ax2.set_xlabel('Inter-receiver distance ($\degree$)')
         if ylabel:
             ax2.set_ylabel('Number of receiver pairs')
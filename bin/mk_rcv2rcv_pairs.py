@@ -11,7 +11,7 @@ from sys import exit, argv
 from getopt import getopt
 from glob import glob
 from os import getcwd
-from numba import jit
+from numba import jit, prange
 from sacpy.geomath import haversine, great_circle_plane_center, point_distance_to_great_circle_plane, antipode
 
 import cartopy.geodesic
@@ -93,29 +93,38 @@ def decipher_plot_options(plot_options):
 
 
 @jit(nopython=True, nogil=True)
-def form_rcv2rcv_pairs(evlo, evla, stlo, stla, az, dist_range, ev_gcd_range, daz_range, 
-                        gc_center_rect_lo1, gc_center_rect_lo2, 
-                        gc_center_rect_la1, gc_center_rect_la2):
+def gc_center_north(evlo, evla, lo1, la1, lo2, la2):
     """
-    Given information for a list of station sharing a same event and many selectin criteria,
-    return the formed receiver-to-receiver pairs.
-
-    Return: (idx1, idx2, dist, clo, cla)
-
-    idx1: a list of index of the first sac file in the pairs.
-    idx2: a list of index of the second sac file in the pairs.
-    dist: a list of distance between the two receivers in the pairs.
-    clo:  a list of great-circle center longitude for the two receivers in the pairs.
-    cla:  a list of great-circle center longitude for the two receivers in the pairs.
+    Return the great-circle center (clo, cla) in the northern hemisphere for the two receivers.
+    The event is used as the second point if the two receivers are at the same location.
+    """
+    if abs(lo1-lo2)<1.0e-3 and abs(la1-la2)<1.0e-3:
+        (clo, cla), pt2 = great_circle_plane_center(evlo, evla, lo1, la1)
+    else:
+        (clo, cla), pt2 = great_circle_plane_center(lo1, la1, lo2, la2)
+    if cla < 0.0:
+        clo, cla = pt2
+    return clo % 360, cla
+@jit(nopython=True, nogil=True, parallel=True)
+def pair_filter(evlo, evla, stlo, stla, az, dist_range, ev_gcd_range, daz_range,
+                    gc_center_rect_lo1, gc_center_rect_lo2,
+                    gc_center_rect_la1, gc_center_rect_la2):
+    """
+    Return a matrix `mask` of np.uint8, in which `mask[idx1, idx2]` (idx1 <= idx2) is 1 if the receiver pair
+    passes all the selection criteria, and 0 otherwise.
+    See `form_rcv2rcv_pairs(...)` for the parameters.
     """
     ###
     dist_min, dist_max = dist_range
     gcd_min, gcd_max = ev_gcd_range
     daz_min, daz_max = daz_range
+    flag_daz = daz_min > 0.0 or daz_max < 90.0
+    flag_gcd = gcd_min > 0.0 or gcd_max < 90.0
+    flag_rect = gc_center_rect_lo1.size > 0
     ###
     sz = stlo.size
-    pairs = list()
-    for idx1 in range(sz):
+    mask = np.zeros((sz, sz), dtype=np.uint8)
+    for idx1 in prange(sz):
         lo1, la1, a1 = stlo[idx1], stla[idx1], az[idx1]
         for idx2 in range(idx1, sz):
             lo2, la2, a2 = stlo[idx2], stla[idx2], az[idx2]
@@ -123,10 +132,8 @@ def form_rcv2rcv_pairs(evlo, evla, stlo, stla, az, dist_range, ev_gcd_range, daz
             dist = haversine(lo1, la1, lo2, la2)
             if dist > dist_max or dist < dist_min:
                 continue
-            ###
-            daz, gcd, clo, cla = -12345, -12345, -12345, -12345
             ### daz
-            if daz_min > 0.0 or daz_max < 90.0:
+            if flag_daz:
                 daz = abs(a1-a2) %360
                 if daz > 180:
                     daz = 360-daz
@@ -135,23 +142,13 @@ def form_rcv2rcv_pairs(evlo, evla, stlo, stla, az, dist_range, ev_gcd_range, daz
                 if daz > daz_max or daz < daz_min:
                     continue
             ### gcd
-            if gcd_min > 0.0 or gcd_max < 90.0:
+            if flag_gcd:
                 gcd = abs( point_distance_to_great_circle_plane(evlo, evla, lo1, la1, lo2, la2) )
                 if gcd > gcd_max or gcd < gcd_min:
                     continue
             ### gc_center_rect
-            if gc_center_rect_lo1.size >0:
-                clo, cla = 0.0, 0.0
-                if abs(lo1-lo2)<1.0e-3 and abs(la1-la2)<1.0e-3:
-                    (clo, cla), pt2 = great_circle_plane_center(evlo, evla, lo1, la1)
-                    if cla < 0.0:
-                        clo, cla = pt2
-                else:
-                    (clo, cla), pt2 = great_circle_plane_center(lo1, la1, lo2, la2)
-                    if cla < 0.0:
-                        clo, cla = pt2
-                clo = clo % 360
-                ###
+            if flag_rect:
+                clo, cla = gc_center_north(evlo, evla, lo1, la1, lo2, la2)
                 flag = 0
                 for rlo1, rlo2, rla1, rla2 in zip(gc_center_rect_lo1, gc_center_rect_lo2, gc_center_rect_la1, gc_center_rect_la2):
                     if cla < rla1 or cla > rla2:
@@ -168,12 +165,55 @@ def form_rcv2rcv_pairs(evlo, evla, stlo, stla, az, dist_range, ev_gcd_range, daz
                 if flag == 1:
                     continue
             ###
-            pairs.append( (idx1, idx2, dist, clo, cla) )
-    return  (   np.array([it[0] for it in pairs ], dtype=np.int32),
-                np.array([it[1] for it in pairs ], dtype=np.int32),
-                np.array([it[2] for it in pairs ], dtype=np.float32),
-                np.array([it[3] for it in pairs ], dtype=np.float32),
-                np.array([it[4] for it in pairs ], dtype=np.float32) )
+            mask[idx1, idx2] = 1
+    return mask
+@jit(nopython=True, nogil=True, parallel=True)
+def form_rcv2rcv_pairs(evlo, evla, stlo, stla, az, dist_range, ev_gcd_range, daz_range, 
+                        gc_center_rect_lo1, gc_center_rect_lo2, 
+                        gc_center_rect_la1, gc_center_rect_la2):
+    """
+    Given information for a list of station sharing a same event and many selectin criteria,
+    return the formed receiver-to-receiver pairs.
+
+    Return: (idx1, idx2, dist, clo, cla)
+
+    idx1: a list of index of the first sac file in the pairs.
+    idx2: a list of index of the second sac file in the pairs.
+    dist: a list of distance between the two receivers in the pairs.
+    clo:  a list of great-circle center longitude for the two receivers in the pairs.
+    cla:  a list of great-circle center longitude for the two receivers in the pairs.
+    """
+    mask = pair_filter(evlo, evla, stlo, stla, az, dist_range, ev_gcd_range, daz_range,
+                        gc_center_rect_lo1, gc_center_rect_lo2,
+                        gc_center_rect_la1, gc_center_rect_la2)
+    flag_rect = gc_center_rect_lo1.size > 0
+    ### row offsets of the selected pairs, so that the rows can be written in parallel
+    sz = stlo.size
+    offsets = np.zeros(sz+1, dtype=np.int64)
+    for idx1 in prange(sz):
+        offsets[idx1+1] = np.sum(mask[idx1])
+    offsets = np.cumsum(offsets)
+    npairs = offsets[-1]
+    ###
+    i1   = np.empty(npairs, dtype=np.int32)
+    i2   = np.empty(npairs, dtype=np.int32)
+    dist = np.empty(npairs, dtype=np.float32)
+    clo  = np.full(npairs, -12345, dtype=np.float32)
+    cla  = np.full(npairs, -12345, dtype=np.float32)
+    for idx1 in prange(sz):
+        k = offsets[idx1]
+        lo1, la1 = stlo[idx1], stla[idx1]
+        for idx2 in range(idx1, sz):
+            if mask[idx1, idx2] == 0:
+                continue
+            lo2, la2 = stlo[idx2], stla[idx2]
+            i1[k], i2[k] = idx1, idx2
+            dist[k] = haversine(lo1, la1, lo2, la2)
+            if flag_rect:
+                x, y = gc_center_north(evlo, evla, lo1, la1, lo2, la2)
+                clo[k], cla[k] = x, y
+            k += 1
+    return i1, i2, dist, clo, cla
 
 def run(h5fnm, dist_range, ev_gcd_range=None, daz_range=None,
                 gc_center_rect_lo1=None, gc_center_rect_lo2=None, 
@@ -8,6 +8,7 @@ import matplotlib.pyplot as plt
 from getopt import getopt
 from sys import exit, argv
 import numpy as np
+from numba import jit, prange
 from sacpy.processing import iirfilter_f32, taper, max_amp_index
 import os, os.path
 import matplotlib.ticker as mtick
@@ -27,27 +28,29 @@ def run(h5_filename, figname, dist_range=None, cc_time_range=None,
             os.makedirs(fig_outdir)
     ###
     fid = h5_File(h5_filename, 'r')
-    cc_t0, cc_t1, delta = fid['ccstack'].attrs['cc_t0'], fid['ccstack'].attrs['cc_t1'], fid['ccstack'].attrs['delta']
-    mat = fid['ccstack'][:]
-    dist = fid['dist'][:]
-    stack_count = fid['stack_count'][:]
-    abs_amp = fid['absolute_amp'][:]
+    dset = fid['ccstack']
+    cc_t0, cc_t1, delta = dset.attrs['cc_t0'], dset.attrs['cc_t1'], dset.attrs['delta']
+    dist = fid['dist'][...]
+    stack_count = fid['stack_count'][...]
+    abs_amp = fid['absolute_amp'][...]
 
-    ### cut given distance and time range
+    ### cut given distance and time range, and read only that part of the ccstack from the file
+    c1, c2 = 0, dset.shape[1]
     if cc_time_range != None:
-        i1 = int( np.round((cc_time_range[0]-cc_t0)/delta) )
-        i2 = int( np.round((cc_time_range[1]-cc_t0)/delta) )
-        mat = mat[:, i1:i2]
-        cc_t0, cc_t1 = cc_time_range
-        #print(i1, i2)
+        c1 = max(int( np.round((cc_time_range[0]-cc_t0)/delta) ), 0)
+        c2 = min(int( np.round((cc_time_range[1]-cc_t0)/delta) ), dset.shape[1])
+        cc_t0, cc_t1 = cc_t0+c1*delta, cc_t0+c2*delta
+        #print(c1, c2)
+    r1, r2 = 0, dist.size
     if dist_range != None:
         d1, d2 = dist_range
-        i1 = np.argmin(abs(dist-d1))
-        i2 = np.argmin(abs(dist-d2)) + 1
-        mat = mat[i1:i2, :]
-        dist = dist[i1:i2]
-        stack_count = stack_count[i1:i2]
-        abs_amp = abs_amp[i1:i2]
+        r1 = np.argmin(abs(dist-d1))
+        r2 = np.argmin(abs(dist-d2)) + 1
+        dist = dist[r1:r2]
+        stack_count = stack_count[r1:r2]
+        abs_amp = abs_amp[r1:r2]
+    mat = dset[r1:r2, c1:c2]
+    fid.close()
 
     ### filter
     btype, f1, f2 = filter_setting
@@ -63,21 +66,15 @@ def run(h5_filename, figname, dist_range=None, cc_time_range=None,
             #mat[irow,:taper_sz] = 0.0
 
     ### adjust amplitude
-    nrow = abs_amp.size
     if norm_settings == 'raw':
-        for irow in range(nrow):
-            mat[irow,:] *= abs_amp[irow]
+        mat *= abs_amp.reshape((-1, 1))
     elif norm_settings == 'stack_average':
-        for irow in range(nrow):
-            v1, v2 = abs_amp[irow], stack_count[irow]
-            if v2 > 0:
-                mat[irow,:] *= (v1/v2)
+        scale = np.ones(abs_amp.size, dtype=mat.dtype)
+        np.divide(abs_amp, stack_count, out=scale, where=stack_count>0)
+        mat *= scale.reshape((-1, 1))
     elif norm_settings == 'unit':
-        for irow in range(nrow):
-            #print( np.argmax(mat[irow,:]) )
-            v = np.max( mat[irow,:] )
-            if v > 0.0:
-                mat[irow,:] *= (1.0/v)
+        peak = mat.max(axis=1, keepdims=True)
+        np.divide(mat, peak, out=mat, where=peak>0.0)
     elif type(norm_settings) == tuple: # norm for each traces
         (xs, ts), method, search_window, outfnm = norm_settings
         tpos, tneg = np.zeros(dist.size), np.zeros(dist.size)
@@ -114,8 +111,9 @@ def run(h5_filename, figname, dist_range=None, cc_time_range=None,
                 mat[irow, :-ndt] = 0
 
     ### for imshow(...)
+    # normalize, clip, and quantize the row-major (dist, time) matrix in a single scan, and then transpose only for imshow
+    img = normalize_clip_to_u8(mat, -vmax, vmax).transpose()
     mat = mat.transpose()
-    mat *= (1.0/np.max(mat) )
     
     ax1, ax2 = None, None
     if axhist:
@@ -123,15 +121,17 @@ def run(h5_filename, figname, dist_range=None, cc_time_range=None,
     else:
         fig, ax1 = plt.subplots(1, 1, figsize= figsize )
     ###
-    ax1.imshow(mat, extent=(dist_range[0], dist_range[1], cc_t0, cc_t1 ), aspect='auto', cmap='gray', interpolation= interpolation,
-            vmin=-vmax, vmax=vmax, origin='lower')
+    ax1.imshow(img, extent=(dist_range[0], dist_range[1], cc_t0, cc_t1 ), aspect='auto', cmap='gray', interpolation= interpolation,
+            vmin=0, vmax=255, origin='lower')
     ###
-    if lines != None:
-        for d, t in lines:
-            if adjust_time_axis != None:
-                sc, xc = adjust_time_axis
-                t = t - sc*(d-xc)
-            ax1.plot(d, t, '.', color='C0', alpha= 0.6, markersize=3)
+    if lines != None and len(lines) > 0:
+        # all the lines share the same style, so draw them as a single Line2D of markers
+        all_d = np.concatenate( [d for d, t in lines] )
+        all_t = np.concatenate( [t for d, t in lines] )
+        if adjust_time_axis != None:
+            sc, xc = adjust_time_axis
+            all_t = all_t - sc*(all_d-xc)
+        ax1.plot(all_d, all_t, '.', color='C0', alpha= 0.6, markersize=3)
     ###
     dist_range = (dist[0], dist[-1] ) if dist_range == None else dist_range
     ### search for max/min points for each trace
@@ -167,8 +167,10 @@ def run(h5_filename, figname, dist_range=None, cc_time_range=None,
     ax1.set_title(title, fontsize=15)
     ###
     if axhist:
-        tmp = stack_count[stack_count>0]
-        ax2.bar(dist, stack_count, align='center', color='gray', width= dist[1]-dist[0] )
+        # a single filled path instead of a Rectangle patch per bar
+        dw = dist[1]-dist[0]
+        edges = np.concatenate( (dist-dw*0.5, [dist[-1]+dw*0.5]) )
+        ax2.stairs(stack_count, edges, fill=True, color='gray')
         ax2.set_xlim(dist_range)
         ax2.set_ylim(bottom=0, top=np.max(stack_count[1:])+30 )
         ax2.set_xlabel('Inter-receiver distance ($\degree$)')
@@ -190,6 +192,22 @@ def run(h5_filename, figname, dist_range=None, cc_time_range=None,
     plt.savefig(figname, bbox_inches = 'tight', pad_inches = 0.05, dpi=dpi)
     plt.close()
 
+@jit(nopython=True, nogil=True, parallel=True)
+def normalize_clip_to_u8(mat, vlo, vhi):
+    """
+    Normalize the `mat` by its maximum, clip it into [vlo, vhi], and map it into an uint8 image,
+    in which 0 and 255 are for vlo and vhi, respectively.
+    """
+    scale = 1.0/np.max(mat)
+    c = 255.0/(vhi-vlo)
+    nrow, ncol = mat.shape
+    img = np.empty((nrow, ncol), dtype=np.uint8)
+    for irow in prange(nrow):
+        for icol in range(ncol):
+            v = min(max(mat[irow, icol]*scale, vlo), vhi)
+            img[irow, icol] = np.uint8( (v-vlo)*c + 0.5 )
+    return img
+
 def plt_options(args):
     """
     """
@@ -5,43 +5,69 @@ This contain sets of geometric methods, especially for spherical coordinates.
 """
 
 import numpy as np
-from math import radians #, cos, sin, asin, sqrt
-from numba import jit, float64, types
+from math import radians, degrees, sin, cos, tan, asin, atan2, sqrt
+from numba import jit, prange, float64, types
 
 
 ### coordinates transformation
-@jit(types.UniTuple(float64, 2)(float64, float64), nopython=True, nogil=True)
+@jit(types.UniTuple(float64, 2)(float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
+def _antipode(lon, lat):
+    """
+    The same as `antipode(lon, lat)` without the modulo, for internal callers with `lon` in [-180, 360),
+    which covers both the [0, 360) and (-180, 180] conventions.
+    """
+    shift = 180.0 if lon < 180.0 else -180.0
+    return lon + shift, -lat
+
+@jit(types.UniTuple(float64, 2)(float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def antipode(lon, lat):
     """
     Calculate antipode of a point.
-    Return (lon, lat) of the new point in degree.
+    Return (lon, lat) of the new point in degree. The returned longitude is in [0, 360).
     """
-    new_lon = (lon + 180) % 360
-    new_lat = -lat
-    return new_lon, new_lat
+    return _antipode(lon % 360.0, lat)
 
-@jit(types.UniTuple(float64, 3)(float64, float64, float64), nopython=True, nogil=True)
+@jit(types.UniTuple(float64, 3)(float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def xyz_to_rlola(x, y, z):
     """
     Given (x, y, z), return (r, lo, la)
     """
-    r  = np.sqrt( x*x+y*y+z*z )
-    lo = np.rad2deg( np.arctan2(y, x) )
-    la = np.rad2deg( np.arctan2(z, np.sqrt(x*x+y*y) ) )
+    r  = sqrt( x*x+y*y+z*z )
+    lo = degrees( atan2(y, x) )
+    la = degrees( atan2(z, sqrt(x*x+y*y) ) )
     return r, lo, la
 
-@jit(types.UniTuple(float64, 3)(float64, float64, float64), nopython=True, nogil=True)
+@jit(types.UniTuple(float64, 3)(float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def rlola_to_xyz(radius, lo, la):
     """
     Given (radius, lo, la), return (x,y,z) coordinates.
     """
     lam, phi = radians(lo), radians(la)
-    x = np.cos(phi)*np.cos(lam)*radius
-    y = np.cos(phi)*np.sin(lam)*radius
-    z = np.sin(phi)*radius
+    r_cos_phi = cos(phi)*radius
+    x = r_cos_phi*cos(lam)
+    y = r_cos_phi*sin(lam)
+    z = sin(phi)*radius
     return x,y,z
 
-@jit(float64(float64, float64, float64, float64), nopython=True, nogil=True)
+@jit(types.UniTuple(float64, 3)(float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
+def _ll_to_xyz_unit(lo, la):
+    """
+    The same as `rlola_to_xyz(1.0, lo, la)`.
+    """
+    lam, phi = radians(lo), radians(la)
+    cos_phi = cos(phi)
+    return cos_phi*cos(lam), cos_phi*sin(lam), sin(phi)
+
+@jit(types.UniTuple(float64, 2)(float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
+def _xyz_to_ll_unit(x, y, z):
+    """
+    The same as `xyz_to_rlola(x, y, z)[1:]`, without computing the radius.
+    """
+    lo = degrees( atan2(y, x) )
+    la = degrees( atan2(z, sqrt(x*x+y*y) ) )
+    return lo, la
+
+@jit(float64(float64, float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def haversine(lon1, lat1, lon2, lat2):
     """
     Return the great circle distance (degree) between two points.
@@ -51,63 +77,127 @@ def haversine(lon1, lat1, lon2, lat2):
     # haversine formula
     dlon = lon2 - lon1
     dlat = lat2 - lat1
-    s1 = np.sin(dlat*0.5)
-    s2 = np.sin(dlon*0.5)
-    a =  s1*s1 + np.cos(lat1) * np.cos(lat2) * s2 * s2
-    c = np.rad2deg( 2.0 * np.arcsin(np.sqrt(a))  )
+    s1 = sin(dlat*0.5)
+    s2 = sin(dlon*0.5)
+    a =  s1*s1 + cos(lat1) * cos(lat2) * s2 * s2
+    c = degrees( 2.0 * asin(sqrt(a))  )
     return c # degree
 
-@jit(float64(float64, float64, float64, float64), nopython=True, nogil=True)
+@jit(float64(float64, float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def azimuth(evlo, evla, stlo, stla):
     """
     Return the azimuth angle (degree) from (evlo, evla) to (stlo, stla)
     """
     phi1, phi2 = radians(evla), radians(stla)
     dlamda     = radians(stlo - evlo)
-    a = np.arctan2(np.cos(phi2) * np.sin(dlamda),  np.cos(phi1)*np.sin(phi2) - np.sin(phi1)*np.cos(phi2)*np.cos(dlamda) )
-    return np.rad2deg(a) % 360.0
+    a = atan2(cos(phi2) * sin(dlamda),  cos(phi1)*sin(phi2) - sin(phi1)*cos(phi2)*cos(dlamda) )
+    return degrees(a) % 360.0
+
+@jit(float64[:](float64[:], float64[:], float64[:], float64[:]), nopython=True, nogil=True, parallel=True, fastmath=True, error_model='numpy', cache=True)
+def haversine_vec(lon1, lat1, lon2, lat2):
+    """
+    The same as `haversine(...)`, but for arrays of points.
+    Return an array of great circle distances (degree) between (lon1[i], lat1[i]) and (lon2[i], lat2[i]).
+    """
+    n = lon1.size
+    dist = np.empty(n)
+    for i in prange(n):
+        phi1, phi2 = radians(lat1[i]), radians(lat2[i])
+        s1 = sin( (phi2-phi1)*0.5 )
+        s2 = sin( radians(lon2[i]-lon1[i])*0.5 )
+        a = s1*s1 + cos(phi1) * cos(phi2) * s2 * s2
+        dist[i] = degrees( 2.0 * asin(sqrt(a)) )
+    return dist
+
+@jit(float64[:](float64[:], float64[:], float64[:], float64[:]), nopython=True, nogil=True, parallel=True, fastmath=True, error_model='numpy', cache=True)
+def azimuth_vec(evlo, evla, stlo, stla):
+    """
+    The same as `azimuth(...)`, but for arrays of points.
+    Return an array of azimuth angles (degree) from (evlo[i], evla[i]) to (stlo[i], stla[i]).
+    """
+    n = evlo.size
+    az = np.empty(n)
+    for i in prange(n):
+        phi1, phi2 = radians(evla[i]), radians(stla[i])
+        dlamda     = radians(stlo[i] - evlo[i])
+        # sin/cos pairs on the same argument, so that they can be fused into sincos
+        s_phi1, c_phi1 = sin(phi1), cos(phi1)
+        s_phi2, c_phi2 = sin(phi2), cos(phi2)
+        s_dlam, c_dlam = sin(dlamda), cos(dlamda)
+        a = degrees( atan2(c_phi2*s_dlam,  c_phi1*s_phi2 - s_phi1*c_phi2*c_dlam) ) # in (-180, 180]
+        az[i] = a + 360.0 if a < 0.0 else a
+    return az
+
+@jit(types.UniTuple(float64, 3)(float64, float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
+def make_gc_axis(lon1, lat1, lon2, lat2):
+    """
+    Return the unit normal (nx, ny, nz) of the great circle plane formed by two points (lon1, lat1) and (lon2, lat2),
+    oriented so that `asin(n dot p)` is the signed distance of the point p to the plane, the same sign as
+    `point_distance_to_great_circle_plane(...)`.
+    (0, 0, 0) is returned if the two points are the same or antipodal.
+    """
+    if abs(lon1-lon2) < 1.0e-4 and abs(lat1-lat2) < 1.0e-4:
+        # pt1 and pt2 are the same point.
+        return 0.0, 0.0, 0.0
+    x1, y1, z1 = _ll_to_xyz_unit(lon1, lat1)
+    x2, y2, z2 = _ll_to_xyz_unit(lon2, lat2)
+    nx, ny, nz = y2*z1-y1*z2, z2*x1-z1*x2, x2*y1-x1*y2 # pt2 x pt1
+    norm = sqrt(nx*nx+ny*ny+nz*nz)
+    if norm <= 0.0:
+        return 0.0, 0.0, 0.0
+    inv = 1.0/norm
+    return nx*inv, ny*inv, nz*inv
 
-@jit(float64(float64, float64, float64, float64, float64, float64), nopython=True, nogil=True)
+@jit(float64(float64, float64, float64, float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def point_distance_to_great_circle_plane(ptlon, ptlat, lon1, lat1, lon2, lat2):
     """
     Return the distance (can be positive or negative) from a point (ptlon, ptlat) to the great circle plane formed by two points
     of (lon1, lat1) and (lon2, lat2).
     #
-    dxt = asin( sin(d13) ⋅ sin(a13−a12) )
+    dxt = asin( n ⋅ p )
     where
-        d13 is (angular) distance from start point to third point
-        a13 is (initial) bearing from start point to third point
-        a12 is (initial) bearing from start point to end point
+        n is the unit normal of the great circle plane (see `make_gc_axis(...)`)
+        p is the unit vector of the point
     """
-    if np.abs(lon1-lon2) < 1.0e-4 and np.abs(lat1-lat2) < 1.0e-4:
-        # pt1 and pt2 are the same point.
-        return 0.0
-    d13 = radians( haversine(lon1, lat1, ptlon, ptlat) )
-    a13 = radians( azimuth(lon1, lat1, ptlon, ptlat) )
-    a12 = radians( azimuth(lon1, lat1, lon2, lat2) )
-    dis = np.arcsin(np.sin(d13) * np.sin(a13-a12) )
-    return np.rad2deg(dis)
+    nx, ny, nz = make_gc_axis(lon1, lat1, lon2, lat2)
+    px, py, pz = _ll_to_xyz_unit(ptlon, ptlat)
+    return degrees( asin( min(1.0, max(-1.0, nx*px+ny*py+nz*pz) ) ) )
 
-@jit(types.UniTuple(types.UniTuple(float64, 2), 2)(float64, float64, float64, float64), nopython=True, nogil=True)
+@jit(float64[:](types.UniTuple(float64, 3), float64[:], float64[:]), nopython=True, nogil=True, parallel=True, fastmath=True, error_model='numpy', cache=True)
+def point_dist_to_gc_plane_vec(axis, ptlon, ptlat):
+    """
+    The same as `point_distance_to_great_circle_plane(...)`, but for arrays of points against a single great circle plane
+    of which the unit normal `axis` is returned by `make_gc_axis(...)`.
+    Return an array of signed distances (degree).
+    """
+    nx, ny, nz = axis
+    n = ptlon.size
+    dist = np.empty(n)
+    for i in prange(n):
+        px, py, pz = _ll_to_xyz_unit(ptlon[i], ptlat[i])
+        dist[i] = degrees( asin( min(1.0, max(-1.0, nx*px+ny*py+nz*pz) ) ) )
+    return dist
+
+@jit(types.UniTuple(types.UniTuple(float64, 2), 2)(float64, float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def great_circle_plane_center(lon1, lat1, lon2, lat2):
     """
     Return two center points coordinate (clon1, clat1), (clon2, clat2) for the great circle plane formed by
     the two input points (lon1, lat1) and (lon2, lat2).
     """
-    #lon1, lat1, lon2, lat2 = radians(lon1), radians(lat1), radians(lon2), radians(lat2)
-    x1, y1, z1 = rlola_to_xyz(1.0, lon1, lat1) #np.cos(lat1)*np.cos(lon1), np.cos(lat1)*np.sin(lon1), np.sin(lat1)
-    x2, y2, z2 = rlola_to_xyz(1.0, lon2, lat2) #np.cos(lat2)*np.cos(lon2), np.cos(lat2)*np.sin(lon2), np.sin(lat2)
+    lam1, phi1, lam2, phi2 = radians(lon1), radians(lat1), radians(lon2), radians(lat2)
+    cos_phi1, cos_phi2 = cos(phi1), cos(phi2)
+    x1, y1, z1 = cos_phi1*cos(lam1), cos_phi1*sin(lam1), sin(phi1)
+    x2, y2, z2 = cos_phi2*cos(lam2), cos_phi2*sin(lam2), sin(phi2)
     x3, y3, z3 = y1*z2-y2*z1, z1*x2-z2*x1, x1*y2-x2*y1
-    lat = np.arctan2(z3, np.sqrt(x3*x3+y3*y3))
-    lon = np.arctan2(y3, x3)
-    #print(x3, y3, z3)
-    lon, lat = np.rad2deg(lon) % 360.0, np.rad2deg(lat)
-    if lat > 0.0:
-        return (lon, lat), antipode(lon, lat)
-    else:
-        return antipode(lon, lat), (lon, lat)
+    lat = degrees( atan2(z3, sqrt(x3*x3+y3*y3)) )
+    lon = degrees( atan2(y3, x3) ) % 360.0
+    # the center in the northern hemisphere goes first. (the same as `(lon, lat), antipode(lon, lat)` if lat > 0 else the reverse)
+    sign = 1.0 if lat > 0.0 else -1.0
+    lon_n = (lon + 90.0*(1.0-sign) ) % 360.0
+    lon_s = (lon_n + 180.0) % 360.0
+    return (lon_n, lat*sign), (lon_s, -lat*sign)
 
-@jit(types.UniTuple(types.UniTuple(float64, 2), 2)(float64, float64, float64, float64, float64, float64, float64), nopython=True, nogil=True)
+@jit(types.UniTuple(types.UniTuple(float64, 2), 2)(float64, float64, float64, float64, float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def great_circle_plane_center_triple(lon1, lat1, lon2, lat2, ptlo, ptla, critical_distance):
     """
     Return two center points coordinate (clon1, clat1), (clon2, clat2) for the great circle plane formed by
@@ -115,28 +205,28 @@ def great_circle_plane_center_triple(lon1, lat1, lon2, lat2, ptlo, ptla, critica
     If the two points are too close (distance below `critical_distance`), then the great circle plane
     is the one passing through the two points and the third point (ptlo, ptla)
     """
-    x1, y1, z1 = rlola_to_xyz(1.0, lon1, lat1)
+    x1, y1, z1 = _ll_to_xyz_unit(lon1, lat1)
     x2, y2, z2 = 0.0, 0.0, 0.0
     if abs(lon1-lon2)>critical_distance or abs(lat1-lat2)>critical_distance:
-        x2, y2, z2 = rlola_to_xyz(1.0, lon2, lat2)
+        x2, y2, z2 = _ll_to_xyz_unit(lon2, lat2)
     else:
-        x2, y2, z2 = rlola_to_xyz(1.0, ptlo, ptla)
+        x2, y2, z2 = _ll_to_xyz_unit(ptlo, ptla)
     x3, y3, z3 = y1*z2-y2*z1, z1*x2-z2*x1, x1*y2-x2*y1
     lat = np.arctan2(z3, np.sqrt(x3*x3+y3*y3))
     lon = np.arctan2(y3, x3)
     #print(x3, y3, z3)
     lon, lat = np.rad2deg(lon) % 360.0, np.rad2deg(lat)
     if lat > 0.0:
-        return (lon, lat), antipode(lon, lat)
+        return (lon, lat), _antipode(lon, lat)
     else:
-        return antipode(lon, lat), (lon, lat)
+        return _antipode(lon, lat), (lon, lat)
 
 
 ##################################################################################################################
 # Functions/methods below are for special purpose
 ##################################################################################################################
 ### frame rotation
-@jit(nopython=True, nogil=True)
+@jit(types.UniTuple(types.UniTuple(float64, 3), 2)(float64, float64, float64, float64), nopython=True, nogil=True, cache=True)
 def sphere_rotate_axis(lo1, la1, lo2, la2):
     """
     Get point cooridinates and right-hand rotation angle, with which after rotation the great circle formed by two fixed points
@@ -144,22 +234,33 @@ def sphere_rotate_axis(lo1, la1, lo2, la2):
     #
     Two antipodal points, each of which has a special rotation angle, will be returned.
     (lo1, la1, angle1), (lo2, la2, angle2)
+    #
+    Note: fastmath and the numpy error model are not used here, as the formulas divide by tan(la1) and tan(la2)
+          for points off the equator.
     """
+    if la1 == 0.0 and la2 == 0.0:
+        # already on the equator, and hence no rotation is needed.
+        return (0.0, 0.0, 0.0), (180.0, 0.0, 0.0)
     lam1, phi1, lam2, phi2 = radians(lo1), radians(la1), radians(lo2), radians(la2)
-    c_1 = np.sin(lam1)/np.tan(phi1) - np.sin(lam2)/np.tan(phi2)
-    c_2 = np.cos(lam1)/np.tan(phi1) - np.cos(lam2)/np.tan(phi2)
-    lo1 = np.rad2deg( np.arctan2(c_1, c_2) )
+    if la1 == 0.0:
+        # (lo1, la1) is where the great circle crosses the equator, and hence is the axis.
+        pass
+    elif la2 == 0.0:
+        lo1 = lo2
+    else:
+        c_1 = np.sin(lam1)/np.tan(phi1) - np.sin(lam2)/np.tan(phi2)
+        c_2 = np.cos(lam1)/np.tan(phi1) - np.cos(lam2)/np.tan(phi2)
+        lo1 = np.rad2deg( np.arctan2(c_1, c_2) )
     lo2, junk = antipode(lo1, 0.0)
-    return_value = []
-    for lo in [lo1, lo2]:
+    angles = np.zeros(2)
+    for idx, lo in enumerate( (lo1, lo2) ):
         lam_tmp = radians(lo + 90)
         c_1 = np.tan(phi1)/np.sin(lam1-lam_tmp) - np.tan(phi2)/np.sin(lam2-lam_tmp)
         c_2 = 1.0/np.tan(lam1-lam_tmp) - 1.0/np.tan(lam2-lam_tmp)
-        rotate_angle = -np.rad2deg( np.arctan2(c_1, c_2) )
-        return_value.append( (lo, 0, rotate_angle) )
-    return return_value
+        angles[idx] = -np.rad2deg( np.arctan2(c_1, c_2) )
+    return (lo1, 0.0, angles[0]), (lo2, 0.0, angles[1])
 
-@jit(nopython=True, nogil=True)
+@jit(types.UniTuple(float64, 2)(float64, float64, float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def sphere_rotate(lo, la, axis_lo, axis_la, axis_angle_deg):
     """
     Rotate (lo, la) with given axis directin and rotation angle. 
@@ -167,19 +268,22 @@ def sphere_rotate(lo, la, axis_lo, axis_la, axis_angle_deg):
     #
     v_r = v cos(a) + k x v sin(a) + k (k dot v) (1-cos (a) )
     """
-    v = np.array( rlola_to_xyz(1.0, lo, la))
-    k = np.array( rlola_to_xyz(1.0, axis_lo, axis_la) )
+    vx, vy, vz = _ll_to_xyz_unit(lo, la)
+    kx, ky, kz = _ll_to_xyz_unit(axis_lo, axis_la)
     a = radians(axis_angle_deg)
     c, s = np.cos(a), np.sin(a)
-    v_r = v * c + np.cross(k, v) * s + k * np.dot(k, v) * (1.0-c)
-    x, y, z = v_r
-    junk, new_lo, new_la= xyz_to_rlola(x, y, z)    
-    return new_lo, new_la
+    # component-wise, without allocating arrays for the 3-vectors
+    k_dot_v = (kx*vx + ky*vy + kz*vz) * (1.0-c)
+    cx, cy, cz = ky*vz-kz*vy, kz*vx-kx*vz, kx*vy-ky*vx # k x v
+    x = vx*c + cx*s + kx*k_dot_v
+    y = vy*c + cy*s + ky*k_dot_v
+    z = vz*c + cz*s + kz*k_dot_v
+    return _xyz_to_ll_unit(x, y, z)
 
 ###
 #  geometry for tranformating spherical points into equator
 ###
-@jit(nopython=True, nogil=True)
+@jit(types.UniTuple(float64, 3)(float64, float64, float64, float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def trans2equator(d1, d2, az1, az2, inter_station_dist, daz):
     """
     For two stations and one event that are nearly on great circle plane, 
@@ -199,10 +303,10 @@ def trans2equator(d1, d2, az1, az2, inter_station_dist, daz):
 ###
 #  geometry for same az difference in X-Y plane
 ###
-@jit(nopython=True, nogil=True)
+@jit(types.UniTuple(types.UniTuple(float64[:], 2), 2)(float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def __internel_line_same_daz_xy(x1, x2, angle_deg):
     """
-    Get list of points for which the difference of direction to two fixed points (x1, 0), (x2, 0) is a  constant angle.
+    Get arrays of points for which the difference of direction to two fixed points (x1, 0), (x2, 0) is a  constant angle.
     """
     npts = 128
     if np.abs(angle_deg) <= 1.0e-6:
@@ -214,30 +318,25 @@ def __internel_line_same_daz_xy(x1, x2, angle_deg):
         x_max = (1 + np.sqrt(1.0+1.0/c_tan/c_tan) )* c_l * 0.5 * 0.999
         xs = np.linspace(x_min, x_max, npts) + x1
         ys = xs * 0.0
-        return (xs, ys), (np.array(0), np.array(0) )
+        return (xs, ys), (np.zeros(0), np.zeros(0) )
     c_tan = np.tan( radians(angle_deg) )
     c_l   = x2 - x1
     c_l_tan = c_l / c_tan
     x_min = (1 - np.sqrt(1.0+1.0/c_tan/c_tan) )* c_l * 0.5 * 0.999
     x_max = (1 + np.sqrt(1.0+1.0/c_tan/c_tan) )* c_l * 0.5 * 0.999
-    lst_x1, lst_y1 = [], []
-    for x in np.linspace(x_min, x_max, npts):
-        y = (c_l_tan + np.sqrt(c_l_tan*c_l_tan-4.0*(x*x-x*c_l))) * 0.5
-        x = x + x1
-        lst_x1.append(x)
-        lst_y1.append(y)
-    lst_x2, lst_y2 = [], []
-    for x in np.linspace(x_min, x_max, npts):
-        y = (c_l_tan - np.sqrt(c_l_tan*c_l_tan-4.0*(x*x-x*c_l))) * 0.5
-        x = x + x1
-        lst_x2.append(x)
-        lst_y2.append(y)
-    lst_x2.reverse(), lst_y2.reverse()
-    return (lst_x1, lst_y1), (lst_x2, lst_y2 )
-@jit(nopython=True, nogil=True)
+    xs = np.linspace(x_min, x_max, npts)
+    xs1, ys1 = np.empty(npts), np.empty(npts)
+    xs2, ys2 = np.empty(npts), np.empty(npts)
+    for k in range(npts):
+        x = xs[k]
+        junk = np.sqrt(c_l_tan*c_l_tan-4.0*(x*x-x*c_l))
+        xs1[k], ys1[k] = x + x1, (c_l_tan + junk) * 0.5
+        xs2[k], ys2[k] = x + x1, (c_l_tan - junk) * 0.5
+    return (xs1, ys1), (xs2[::-1].copy(), ys2[::-1].copy() )
+@jit(types.UniTuple(types.UniTuple(float64[:], 2), 2)(float64, float64, float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def line_same_daz_xy(x1, y1, x2, y2, angle_deg):
     """
-    Get list of points for which the difference of direction to two fixed points (x1, y1), (x2, y2) is a  constant angle.
+    Get arrays of points for which the difference of direction to two fixed points (x1, y1), (x2, y2) is a  constant angle.
     """
     belta = np.arctan2(y2-y1, x2-x1)
     c, s = np.cos(belta), np.sin(belta)
@@ -245,56 +344,49 @@ def line_same_daz_xy(x1, y1, x2, y2, angle_deg):
     y1_prime = -x1*s+y1*c
     x2_prime =  x2*c+y2*s
     y2_prime = -x2*s+y2*c
-    (xs1_prime, ys1_prime), (xs2_prime, ys2_prime) = __internel_line_same_daz(x1_prime, x2_prime, angle_deg)
-    xs1, ys1 = [], []
-    for x_prime, y_prime in zip(xs1_prime, ys1_prime):
-        y_prime = y_prime + y2_prime
-        x = x_prime*c - y_prime*s
-        y = x_prime*s + y_prime*c
-        xs1.append(x)
-        ys1.append(y)
-    xs2, ys2 = [], []
-    for x_prime, y_prime in zip(xs2_prime, ys2_prime):
-        y_prime = y_prime + y2_prime
-        x = x_prime*c - y_prime*s
-        y = x_prime*s + y_prime*c
-        xs2.append(x)
-        ys2.append(y)
+    (xs1_prime, ys1_prime), (xs2_prime, ys2_prime) = __internel_line_same_daz_xy(x1_prime, x2_prime, angle_deg)
+    # rotate back
+    ys1_prime = ys1_prime + y2_prime
+    ys2_prime = ys2_prime + y2_prime
+    xs1, ys1 = xs1_prime*c - ys1_prime*s, xs1_prime*s + ys1_prime*c
+    xs2, ys2 = xs2_prime*c - ys2_prime*s, xs2_prime*s + ys2_prime*c
     return (xs1, ys1), (xs2, ys2)
 
 ###
 #  geometry for same az difference in sphere
 ###
-@jit(nopython=True, nogil=True)
+@jit(types.UniTuple(float64[:], 2)(float64, float64, float64), nopython=True, nogil=True, cache=True)
 def __internel_line_same_daz_sphere(lo1, lo2, angle_deg):
     """
-    Get list of points for which the difference of azimuth to two fixed points (lo1, 0), (lo2, 0) is a  constant angle.
+    Get arrays of points for which the difference of azimuth to two fixed points (lo1, 0), (lo2, 0) is a  constant angle.
     """
     npts = 2048
     if np.abs(angle_deg) <= 1.0e-6:
         lo_lst = np.linspace(-180, 180, npts)
         la_lst = lo_lst * 0.0
-        return lo_lst.tolist(), la_lst.tolist()
-    c_tan = np.tan(radians(angle_deg) )
+        return lo_lst, la_lst
+    c_tan = tan(radians(angle_deg) )
+    two_c_tan, four_c_tan_sq = 2.0*c_tan, 4.0*c_tan*c_tan
     rad1, rad2 = radians(lo1), radians(lo2)
-    lo_lst, la_lst = [], []
+    lo_lst, la_lst = np.empty(2*npts), np.empty(2*npts) # at most two points for each lo
+    n = 0
     for lo in np.linspace(-np.pi, np.pi, npts):
-        tmp = np.rad2deg(lo)
-        t1 = np.tan(rad1 - lo)
-        t2 = np.tan(rad2 - lo)
-        d = (t1-t2)*(t1-t2) - 4.0*c_tan*c_tan*t1*t2
+        t1 = tan(rad1 - lo)
+        t2 = tan(rad2 - lo)
+        dt = t2-t1
+        d = dt*dt - four_c_tan_sq*t1*t2
         if d < 0:
             # no results
             continue
-        sin_phi1 = (t2-t1 - np.sqrt(d)) / (2.0*c_tan)
-        sin_phi2 = (t2-t1 + np.sqrt(d)) / (2.0*c_tan)
-        for value in [sin_phi1, sin_phi2]:
-            if np.abs(value ) <= 1:
-                phi = np.arcsin(value)
-                lo_lst.append( np.rad2deg(lo) )
-                la_lst.append( np.rad2deg(phi) )
-    return lo_lst, la_lst
-#@jit( types.UniTuple(float64[:],2)(float64, float64, float64, float64, float64), nopython=True, nogil=True)
+        lo_deg = np.rad2deg(lo)
+        sd = sqrt(d)
+        for value in ( (dt - sd) / two_c_tan, (dt + sd) / two_c_tan ):
+            if abs(value) <= 1:
+                lo_lst[n] = lo_deg
+                la_lst[n] = np.rad2deg( asin(value) )
+                n += 1
+    return lo_lst[:n], la_lst[:n]
+@jit( types.UniTuple(float64[:],2)(float64, float64, float64, float64, float64), nopython=True, nogil=True, fastmath=True, error_model='numpy', cache=True)
 def internel_line_same_daz_sphere(lo1, la1, lo2, la2, angle_deg):
     """
     Get list of points for which the difference of azimuth to two fixed points (lo1, la1), (lo2, la2) is a  constant angle.
@@ -304,15 +396,16 @@ def internel_line_same_daz_sphere(lo1, la1, lo2, la2, angle_deg):
     new_lo1, junk = sphere_rotate(lo1, la1, a_lo, a_la, a_ang)
     new_lo2, junk = sphere_rotate(lo2, la2, a_lo, a_la, a_ang)
     new_lo_lst, new_la_lst = __internel_line_same_daz_sphere(new_lo1, new_lo2, angle_deg)
-    lo_lst, la_lst = [], []
-    for it_lo, it_la in zip(new_lo_lst, new_la_lst):
-        v_lo, v_la = sphere_rotate(it_lo, it_la, a_lo, a_la, -a_ang)
-        lo_lst.append(v_lo)
-        la_lst.append(v_la)
-    return np.array(lo_lst), np.array(la_lst)
+    n = new_lo_lst.size
+    lo_lst, la_lst = np.empty(n), np.empty(n)
+    for idx in range(n):
+        v_lo, v_la = sphere_rotate(new_lo_lst[idx], new_la_lst[idx], a_lo, a_la, -a_ang)
+        lo_lst[idx], la_lst[idx] = v_lo, v_la
+    return lo_lst, la_lst
 
 if __name__ == "__main__":
     print( azimuth(0.0, 0.0, 10.0, 30.0) )
     print( haversine(0.0, 0.0, 10.0, 30.0) )
+    print( haversine_vec(np.zeros(3), np.zeros(3), np.array([10.0, 20.0, 30.0]), np.array([30.0, 20.0, 10.0]) ) )
     print( great_circle_plane_center(0.0, 0.0, 10.0, 30.0) )
     print( point_distance_to_great_circle_plane(2.0, 3.0, 0.0, 0.0, 3.0, 0.0) )
\ No newline at end of file
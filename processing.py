@@ -20,6 +20,10 @@ Inplace IIR filter
 >>> zs = np.random.random(10000)-0.5
 >>> iirfilter2_f32((xs, ys, zs), delta, 0, btype, f1, f2, ord, npass)
 >>>
+>>> sos = iirdesign_f32(delta, 0, btype, f1, f2, ord) # design once, and apply to many traces
+>>> sosfilter2_f32((xs, ys, zs), sos, npass)
+>>> amp = sosfreqz_f32(sos, np.arange(0.0, 5.0, 0.01), delta, npass) # amplitude response at frequencies from 0 to 5 Hz
+>>>
 
 Inplace taper
 -------------------------
@@ -34,6 +38,8 @@ Inplace detrend
 
 >>> rmean(xs)
 >>> detrend(xs)
+>>> mat = np.random.random((10, 10000)).astype(np.float32) # each row is a trace
+>>> detrend2(mat)
 >>>
 
 Searching given time series
@@ -71,6 +77,9 @@ Inplace whitening
 >>> tnorm_f32(xs, delta, wtlen, f1, f2, water_level_ratio, taper_halfsize)
 >>> wflen = 0.02
 >>> fwhiten_f32(xs, delta, wflen, water_level_ratio, taper_halfsize)
+>>> # whitening for all rows of a matrix
+>>> tnorm2_f32(mat, delta, wtlen, f1, f2, water_level_ratio, taper_halfsize)
+>>> fwhiten2_f32(mat, delta, wflen, water_level_ratio, taper_halfsize)
 >>>
 """
 
@@ -129,6 +138,16 @@ def iirfilter2_f32(tuple_xs, delta, aproto, type, f1=0.0, f2=0.0, ord=2, npass=2
 
     tuple_xs: a tuple of 1D trace. Each trace is of numpy.ndarray(dtype=np.float32).
     """
+    sos = iirdesign_f32(delta, aproto, type, f1, f2, ord, trbndw, a)
+    sosfilter2_f32(tuple_xs, sos, npass)
+@jit(nopython=True, nogil=True)
+def iirdesign_f32(delta, aproto, type, f1=0.0, f2=0.0, ord=2, trbndw=0.0, a=0.0):
+    """
+    Design the iirfilter once, so that it can be applied to many traces with `sosfilter2_f32(...)`.
+    The parameters are the same as `iirfilter_f32(...)`.
+
+    Return: a tuple (sn, sd, nsect) of the second-order sections.
+    """
     sn    = np.zeros(30, dtype=np.float32)
     sd    = np.zeros(30, dtype=np.float32)
     nsect = np.zeros(2, dtype=np.int32)
@@ -136,10 +155,41 @@ def iirfilter2_f32(tuple_xs, delta, aproto, type, f1=0.0, f2=0.0, ord=2, npass=2
     ptr_sd     = ffi.from_buffer(sd)
     ptr_nsects = ffi.from_buffer(nsect)
     libsac_design(ord, type, aproto, a, trbndw, f1, f2, delta, ptr_sn, ptr_sd, ptr_nsects)
+    return sn, sd, nsect
+@jit(nopython=True, nogil=True)
+def sosfilter2_f32(tuple_xs, sos, npass=2):
+    """
+    Inplace filter a tuple of 1D traces, or each row of a 2D matrix, with the designed filter `sos`.
+    Each trace is of numpy.ndarray(dtype=np.float32).
+
+    sos:   the returned value of `iirdesign_f32(...)`.
+    npass: 1 or 2
+    """
+    sn, sd, nsect = sos
+    ptr_sn     = ffi.from_buffer(sn)
+    ptr_sd     = ffi.from_buffer(sd)
     flag = False if npass == 1 else True
-    for it in tuple_xs:
+    for i in range(len(tuple_xs)): # indexing, as iterating a 2D matrix gives non-contiguous rows for `ffi.from_buffer`
+        it = tuple_xs[i]
         ptr = ffi.from_buffer( it )
         libsac_apply(ptr, it.size, flag, ptr_sn, ptr_sd, nsect[0])
+def sosfreqz_f32(sos, freqs, delta, npass=2):
+    """
+    Return the amplitude response of the designed filter `sos` at the frequencies `freqs` (in Hz).
+
+    sos:   the returned value of `iirdesign_f32(...)`.
+    delta: sampling time interval in sec.
+    npass: 1 or 2. The amplitude is squared for the two-pass (zero-phase) filtering.
+    """
+    sn, sd, nsect = sos
+    z = np.exp(-2.0j*np.pi*np.asarray(freqs)*delta) # z^-1
+    h = np.ones(z.size, dtype=np.complex128)
+    for isect in range(nsect[0]):
+        b0, b1, b2 = sn[3*isect:3*isect+3]
+        a1, a2 = sd[3*isect+1:3*isect+3]
+        h *= (b0 + b1*z + b2*z*z) / (1.0 + a1*z + a2*z*z)
+    amp = np.abs(h)
+    return amp if npass == 1 else amp*amp
 
 #############################################################################################################################
 # JIT in place taper
@@ -211,6 +261,24 @@ def detrend(xs):
 
     tmp = tmp*k+b
     xs -= tmp
+@jit(nopython=True, nogil=True)
+def detrend2(tuple_xs):
+    """
+    Inplace detrend for a tuple of 1D traces of same size, or for each row of a 2D matrix.
+    Each trace is of numpy.ndarray(dtype=np.float32).
+    """
+    len = tuple_xs[0].size
+    xmean = (len-1)*len*0.5/len
+    tmp = np.arange(len, dtype=np.float64)
+    s2 = np.sum(tmp*tmp)
+    junk = s2-len*xmean*xmean
+    for xs in tuple_xs:
+        xs -= np.mean(xs)
+        ymean = np.mean(xs)
+        s1 = np.sum(tmp*xs)
+        k = (s1-len*ymean*xmean) / junk
+        b = ymean - k*xmean
+        xs -= tmp*k+b
 
 #############################################################################################################################
 #  search sth from time series
@@ -416,6 +484,25 @@ def tnorm_f32(xs, delta, winlen, f1, f2, water_level_ratio= 1.0e-5, taper_halfsi
 
     if taper_halfsize > 0:
         taper(xs, taper_halfsize)
+@jit(nopython=True, nogil=True)
+def tnorm2_f32(tuple_xs, delta, winlen, f1, f2, water_level_ratio= 1.0e-5, taper_halfsize=0):
+    """
+    Inplace temporal normalization for a tuple of 1D traces, or for each row of a 2D matrix.
+    Each trace is of numpy.ndarray(dtype=np.float32).
+    The parameters are the same as `tnorm_f32(...)`.
+    The bandpass filter to form the weight is designed once for all traces.
+    """
+    wndsize = int(round(winlen/delta) )
+    wndsize = (wndsize // 2)*2 +1
+    sos = iirdesign_f32(delta, 0, 2, f1, f2, 2)
+    for xs in tuple_xs:
+        weight = np.copy(xs)
+        sosfilter2_f32((weight, ), sos, 2)
+        weight = moving_average_abs_f32(weight, wndsize, False)
+        weight += ( np.max(weight) * water_level_ratio )
+        xs /= weight
+        if taper_halfsize > 0:
+            taper(xs, taper_halfsize)
 def fwhiten_f32(xs, delta, winlen, water_level_ratio= 1.0e-5, taper_halfsize=0, speedup_i1= -1, speedup_i2= -1):
     """
     Inplace frequency whitening of input trace `xs` (a numpy.ndarray(dtype=np.float32) object).
@@ -449,6 +536,35 @@ def fwhiten_f32(xs, delta, winlen, water_level_ratio= 1.0e-5, taper_halfsize=0,
 
     if taper_halfsize > 0:
         taper(xs, taper_halfsize)
+def fwhiten2_f32(mat, delta, winlen, water_level_ratio= 1.0e-5, taper_halfsize=0, speedup_i1= -1, speedup_i2= -1):
+    """
+    Inplace frequency whitening for each row of the 2D matrix `mat` (a numpy.ndarray(dtype=np.float32) object).
+    The ffts are computed for all rows at once.
+    The parameters are the same as `fwhiten_f32(...)`.
+    """
+    npts = mat.shape[1]
+    fftsize = npts
+    if fftsize % 2 != 0: # EVET points make faster FFT than ODD points
+        fftsize = fftsize + 1
+    spec = rfft(mat, fftsize, axis=1)
+
+    if speedup_i2 >= 1: ## for acceleration purpose
+        spec = spec[:, :speedup_i2]
+
+    df =1.0/(fftsize*delta)
+    wndsize = int(winlen/df)
+    wndsize = (wndsize // 2)*2 +1
+
+    weight = np.abs(spec).astype(np.float32)
+    for irow in range(mat.shape[0]):
+        w = moving_average_f32(weight[irow], wndsize, False)
+        w += (w.max() * water_level_ratio)
+        spec[irow] /= w
+
+    mat[:] = irfft(spec, fftsize, axis=1)[:, :npts]
+
+    if taper_halfsize > 0:
+        taper2(mat, taper_halfsize)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+"""
+Checks for the cross-correlation and stacking kernels in `bin/cc_stack_sac.py` against a serial loop over all pairs.
+"""
+import importlib.util
+import os.path
+import numpy as np
+import pytest
+
+for it in ('mpi4py', 'h5py', 'pyfftw', 'sacpy.processing'):
+    pytest.importorskip(it)
+import sacpy.geomath as geomath
+
+def load_cc_stack_sac():
+    fnm = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', 'cc_stack_sac.py')
+    spec = importlib.util.spec_from_file_location('cc_stack_sac', fnm)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+cc = load_cc_stack_sac()
+
+nsac, nk, nrow = 40, 4500, 19 # nk spans several tiles of `cc_tile_size`
+dist_min, dist_max, dist_step = 0.0, 180.0, 10.0
+i1, i2 = 3, 4400
+
+def random_data(seed=0):
+    rng = np.random.default_rng(seed)
+    spec_mat = (rng.standard_normal((nsac, nk)) + 1j*rng.standard_normal((nsac, nk)) ).astype(np.complex64)
+    lon = rng.uniform(0.0, 360.0, nsac).astype(np.float32)
+    lat = rng.uniform(-80.0, 80.0, nsac).astype(np.float32)
+    gcarc = rng.uniform(0.0, 180.0, nsac).astype(np.float32)
+    azimuth = rng.uniform(0.0, 360.0, nsac).astype(np.float32)
+    return spec_mat, lon, lat, gcarc, azimuth
+
+def serial_ccstack(spec_mat, lon, lat, gcarc, epdd, selection=None):
+    """
+    The serial loop over all pairs (isac1, isac2) with isac1 <= isac2.
+    `selection(isac1, isac2)` returns False to drop the pair.
+    """
+    stack_mat = np.zeros((nrow, nk), dtype=np.complex128)
+    stack_count = np.zeros(nrow, dtype=np.int32)
+    d1, d2 = dist_min-dist_step*0.5, dist_max+dist_step*0.5
+    for isac1 in range(nsac):
+        for isac2 in range(isac1, nsac):
+            if epdd:
+                dist = np.float32( abs(gcarc[isac1]-gcarc[isac2]) )
+            else:
+                dist = np.float32( geomath.haversine(lon[isac1], lat[isac1], lon[isac2], lat[isac2]) )
+            if dist > d2 or dist < d1:
+                continue
+            idx = int( np.round((dist-dist_min) / dist_step) )
+            if idx < 0 or idx >= nrow:
+                continue
+            if selection is not None and not selection(isac1, isac2):
+                continue
+            stack_mat[idx, i1:i2] += np.conj(spec_mat[isac1, i1:i2]) * spec_mat[isac2, i1:i2]
+            stack_count[idx] += 1
+    return stack_mat, stack_count
+
+@pytest.mark.parametrize('epdd', [False, True])
+def test_spec_ccstack_equals_serial_loop(epdd):
+    spec_mat, lon, lat, gcarc, azimuth = random_data()
+    ref_stack, ref_count = serial_ccstack(spec_mat, lon, lat, gcarc, epdd)
+    stack_mat = np.zeros((nrow, nk), dtype=np.complex64)
+    stack_count = np.zeros(nrow, dtype=np.int32)
+    count = cc.spec_ccstack(spec_mat, lon, lat, gcarc, epdd, stack_mat, stack_count,
+                            dist_min, dist_max, dist_step, i1, i2, -1.0)
+    assert count == ref_count.sum()
+    assert np.array_equal(stack_count, ref_count)
+    assert np.allclose(stack_mat, ref_stack, rtol=1.0e-4, atol=1.0e-3)
+
+def test_pairs_ccstack_i16_close_to_serial_loop():
+    spec_mat, lon, lat, gcarc, azimuth = random_data()
+    ref_stack, ref_count = serial_ccstack(spec_mat, lon, lat, gcarc, False)
+    stack_mat = np.zeros((nrow, nk), dtype=np.complex64)
+    stack_count = np.zeros(nrow, dtype=np.int32)
+    idx_mat = cc.dist_index(cc.pairwise_dist(lon, lat, gcarc, False), nrow, dist_min, dist_max, dist_step)
+    pairs = cc.index_to_pairs(idx_mat, -1.0)
+    qspec, scale = cc.quantize_spec(spec_mat, i1, i2)
+    count = cc.pairs_ccstack_i16(qspec, scale, pairs, stack_mat, stack_count, i1, i2)
+    assert count == ref_count.sum()
+    assert np.array_equal(stack_count, ref_count)
+    assert np.abs(stack_mat-ref_stack).max() <= 1.0e-3 * np.abs(ref_stack).max()
+
+def serial_round_daz(daz):
+    daz = daz % 360
+    if daz > 180.0:
+        daz = 360.0-daz
+    if daz > 90.0:
+        daz = 180.0-daz
+    return daz
+
+@pytest.mark.parametrize('daz_range, gcd_range', [((-0.1, 90.1), (-0.1, 90.1)), ((5.0, 60.0), (0.0, 40.0))])
+def test_spec_ccstack2_equals_serial_loop(daz_range, gcd_range):
+    spec_mat, lon, lat, gcarc, azimuth = random_data(1)
+    pt_lon, pt_lat = 130.0, -20.0
+    rect = np.array([(0.0, 360.0, 0.0, 60.0), (300.0, 30.0, 60.0, 90.0)] ) # the 2nd one crosses lon=0
+    circle = np.array([(0.0, 90.0, 75.0), (180.0, 0.0, 40.0)] )
+    def selection(isac1, isac2):
+        lo1, la1, lo2, la2 = lon[isac1], lat[isac1], lon[isac2], lat[isac2]
+        clo, cla = cc.sph_center_triple_pts(pt_lon, pt_lat, lo1, la1, lo2, la2)
+        if not any( (cla1<=cla<=cla2) and ( clo1<=clo<=clo2 or (clo1>clo2 and (clo>=clo1 or clo<=clo2)) ) for clo1, clo2, cla1, cla2 in rect):
+            return False
+        if not any( geomath.haversine(clo, cla, cclo, ccla) <= cradius for cclo, ccla, cradius in circle):
+            return False
+        daz = serial_round_daz(azimuth[isac1]-azimuth[isac2])
+        if daz < daz_range[0] or daz > daz_range[1]:
+            return False
+        gcd = abs( geomath.point_distance_to_great_circle_plane(pt_lon, pt_lat, lo1, la1, lo2, la2) )
+        return gcd_range[0] <= gcd <= gcd_range[1]
+    ref_stack, ref_count = serial_ccstack(spec_mat, lon, lat, gcarc, False, selection)
+    assert 0 < ref_count.sum() < nsac*(nsac+1)//2
+    stack_mat = np.zeros((nrow, nk), dtype=np.complex64)
+    stack_count = np.zeros(nrow, dtype=np.int32)
+    count = cc.spec_ccstack2(spec_mat, lon, lat, gcarc, False, stack_mat, stack_count,
+                             dist_min, dist_max, dist_step, i1, i2,
+                             azimuth, pt_lon, pt_lat, daz_range[0], daz_range[1], gcd_range[0], gcd_range[1],
+                             rect[:, 0].copy(), rect[:, 1].copy(), rect[:, 2].copy(), rect[:, 3].copy(),
+                             circle[:, 0].copy(), circle[:, 1].copy(), circle[:, 2].copy(), -1.0)
+    assert count == ref_count.sum()
+    assert np.array_equal(stack_count, ref_count)
+    assert np.allclose(stack_mat, ref_stack, rtol=1.0e-4, atol=1.0e-3)
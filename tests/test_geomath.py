@@ -0,0 +1,33 @@
+"""
+Checks for `sacpy.geomath`.
+"""
+import numpy as np
+import pytest
+
+geomath = pytest.importorskip('sacpy.geomath')
+
+
+def round_daz(daz):
+    daz = daz % 360
+    daz = np.minimum(daz, 360.0-daz)
+    return np.minimum(daz, 180.0-daz)
+
+@pytest.mark.parametrize('lo1, la1, lo2, la2', [(10.0, 5.0, 40.0, 35.0), (10.0, 0.0, 40.0, 35.0), (10.0, -20.0, 40.0, 0.0)])
+def test_internel_line_same_daz_sphere(lo1, la1, lo2, la2):
+    angle = 15.0
+    ### the axis turns both points into the equator, even if one of them is already on the equator
+    (a_lo, a_la, a_ang), junk = geomath.sphere_rotate_axis(lo1, la1, lo2, la2)
+    for lo, la in ((lo1, la1), (lo2, la2)):
+        assert abs(geomath.sphere_rotate(lo, la, a_lo, a_la, a_ang)[1]) < 1.0e-9
+    ### the returned points have the same azimuth difference to the two points
+    lo_lst, la_lst = geomath.internel_line_same_daz_sphere(lo1, la1, lo2, la2, angle)
+    assert lo_lst.size > 0
+    daz = [geomath.azimuth(lo, la, lo1, la1)-geomath.azimuth(lo, la, lo2, la2) for lo, la in zip(lo_lst, la_lst)]
+    assert np.allclose(round_daz(np.array(daz)), angle, atol=1.0e-6)
+
+@pytest.mark.parametrize('lon', [-200.0, -180.0, -10.0, 0.0, 10.0, 180.0, 359.0, 360.0, 400.0, 725.0])
+def test_antipode(lon):
+    new_lon, new_lat = geomath.antipode(lon, 1.0)
+    assert np.isclose(new_lon, (lon+180.0) % 360.0)
+    assert 0.0 <= new_lon < 360.0
+    assert new_lat == -1.0
@@ -0,0 +1,54 @@
+"""
+Run `mpi_dynamic_jobs(...)` of `bin/cc_stack_sac.py` under mpirun with jobs of uneven costs.
+"""
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+
+for it in ('mpi4py', 'h5py', 'pyfftw', 'sacpy.processing'):
+    pytest.importorskip(it)
+
+script = '''
+import sys, time, importlib.util
+import mpi4py
+mpi4py.rc.thread_level = sys.argv[2]
+from mpi4py import MPI
+spec = importlib.util.spec_from_file_location('cc_stack_sac', sys.argv[1])
+cc = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(cc)
+
+comm = MPI.COMM_WORLD
+jobs = [1.0] + [0.1]*12 # the largest job first, as sorted in main
+comm.Barrier()
+t0 = time.time()
+if comm.Get_rank() > 0:
+    time.sleep(0.05) # the other ranks are a bit late
+done = list()
+for ijob, cost in enumerate(cc.mpi_dynamic_jobs(comm, list(enumerate(jobs)) ) ):
+    time.sleep(cost[1])
+    done.append(cost[0])
+t1 = time.time()
+done = comm.gather(done, root=0)
+t0, t1 = comm.gather(t0, root=0), comm.gather(t1, root=0)
+if comm.Get_rank() == 0:
+    print(sorted(sum(done, [])) == list(range(len(jobs))), max(t1)-min(t0), flush=True)
+'''
+
+@pytest.mark.skipif(shutil.which('mpirun') is None, reason='mpirun is not available')
+@pytest.mark.parametrize('thread_level', ['multiple', 'serialized'])
+def test_mpi_dynamic_jobs_uneven_costs(tmp_path, thread_level):
+    fnm = tmp_path / 'run_jobs.py'
+    fnm.write_text(script)
+    cc_fnm = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin', 'cc_stack_sac.py')
+    # `env=os.environ` leaves out the variables that MPI sets in this process if it has been initialized
+    # by other tests, with which the nested mpirun would fail.
+    out = subprocess.run(['mpirun', '-n', '3', '--oversubscribe', sys.executable, str(fnm), cc_fnm, thread_level],
+                         capture_output=True, text=True, timeout=300, env=dict(os.environ) )
+    assert out.returncode == 0, out.stderr
+    flag, elapsed = out.stdout.split()[-2:]
+    assert flag == 'True'
+    # the large job overlaps with all the small ones: about 1.0 sec, instead of 1.6 sec if
+    # the other ranks waited for the large job of RANK0
+    assert float(elapsed) < 1.35
@@ -0,0 +1,40 @@
+"""
+Checks for the filters in `sacpy.processing`.
+"""
+import numpy as np
+import pytest
+
+processing = pytest.importorskip('sacpy.processing')
+
+
+def test_sosfilter2_f32_matrix_equals_iirfilter_f32():
+    delta, f1, f2 = 0.1, 0.05, 1.0
+    rng = np.random.default_rng(0)
+    mat = rng.standard_normal((5, 1000)).astype(np.float32)
+    ref = mat.copy()
+    for xs in ref:
+        processing.iirfilter_f32(xs, delta, 0, 2, f1, f2, 2, 2)
+    sos = processing.iirdesign_f32(delta, 0, 2, f1, f2, 2)
+    processing.sosfilter2_f32(mat, sos, 2)
+    assert np.array_equal(mat, ref)
+    ### a tuple of traces is the same as the matrix
+    tuple_xs = tuple(rng.standard_normal((2, 1000)).astype(np.float32))
+    ref = [xs.copy() for xs in tuple_xs]
+    for xs in ref:
+        processing.iirfilter_f32(xs, delta, 0, 2, f1, f2, 2, 2)
+    processing.sosfilter2_f32(tuple_xs, sos, 2)
+    for xs, ys in zip(tuple_xs, ref):
+        assert np.array_equal(xs, ys)
+
+
+@pytest.mark.parametrize('btype, f1, f2', [(0, 0.0, 1.0), (1, 0.5, 0.0), (2, 0.2, 1.0)])
+@pytest.mark.parametrize('npass', [1, 2])
+def test_sosfreqz_f32_equals_impulse_response(btype, f1, f2, npass):
+    delta, npts = 0.1, 4096
+    sos = processing.iirdesign_f32(delta, 0, btype, f1, f2, 2)
+    xs = np.zeros(npts, dtype=np.float32)
+    xs[npts//2] = 1.0
+    processing.sosfilter2_f32((xs, ), sos, npass)
+    freqs = np.fft.rfftfreq(npts, delta)
+    amp = processing.sosfreqz_f32(sos, freqs, delta, npass)
+    assert np.allclose(np.abs(np.fft.rfft(xs)), amp, atol=1.0e-3)